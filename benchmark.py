@@ -0,0 +1,1125 @@
+import argparse
+import collections
+import contextlib
+import datetime
+import json
+import numpy as np
+import os
+import pickle
+import platform
+import psycopg
+from psycopg.adapt import PyFormat, Transformer
+import random
+import re
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+if os.name == "nt":
+    from transactionwin import Field, PARSE_CHUNK, PREFETCH_CHUNK, RecordBlock, Transactionwin as Transaction
+else:
+    from transactionmac import Field, PARSE_CHUNK, PREFETCH_CHUNK, RecordBlock, Transactionmac as Transaction
+
+import cdc
+
+
+HEADER = ("ssn|cc_num|first|last|gender|street|city|state|zip|lat|long|city_pop|job|dob|acct_num|profile"
+    "|trans_num|trans_date|trans_time|unix_time|category|amt|is_fraud|merchant|merch_lat|merch_long")
+
+
+# stands in for a psycopg connection and counts what would have been sent to the database,
+# each round trip sleeps for latency seconds plus row_latency seconds per row to simulate the network
+# and the server, each row of an insert or copy conflicts with another worker with probability row_conflict,
+# and with record the statements and their parameters are kept in log
+class FakeConnection:
+
+    def __init__(self, latency=0.0, record=False, row_latency=0.0, row_conflict=0.0, commit_latency=0.0,
+            stall=0.0, stall_every=0):
+        self.latency = latency
+        self.row_latency = row_latency
+        self.commit_latency = commit_latency
+        # every stall_every round trips one stalls for stall seconds, like a leaseholder move
+        self.stall = stall
+        self.stall_every = stall_every
+        self.round_trips = 0
+        self.row_conflict = row_conflict
+        self.random = random.Random(0)
+        self.failures = 0
+        self.pipelined_rows = 0
+        self.log = [] if record else None
+        self.statements = 0
+        self.params = 0
+        self.pipelined = False
+        # the next statement fails once when set
+        self.fail = False
+        # statements outside an explicit transaction commit on their own
+        self.transaction = False
+        self.commits = 0
+        self.prepared_max = 100
+        # statements and rows sent per table
+        self.table_statements = collections.Counter()
+        self.table_rows = collections.Counter()
+        # upserts resolved with DO UPDATE and DO NOTHING
+        self.conflicts = collections.Counter()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def round_trip(self, rows=0):
+        if self.pipelined:
+            self.pipelined_rows += rows
+            return
+        commit = 0.0
+        if not self.transaction:
+            self.commits += 1
+            commit = self.commit_latency
+        self.round_trips += 1
+        if self.stall_every and self.round_trips % self.stall_every == 0:
+            commit += self.stall
+        if self.latency or self.row_latency or commit:
+            time.sleep(self.latency + rows * self.row_latency + commit)
+
+    def execute(self, query):
+        if query == "BEGIN":
+            self.transaction = True
+            self.round_trip()
+
+    def commit(self):
+        if self.transaction:
+            self.transaction = False
+            self.round_trip()
+
+    def rollback(self):
+        if self.transaction:
+            self.transaction = False
+            time.sleep(self.latency)
+
+    @contextlib.contextmanager
+    def pipeline(self):
+        self.pipelined = True
+        self.pipelined_rows = 0
+        try:
+            yield self
+        finally:
+            self.pipelined = False
+            self.round_trip(self.pipelined_rows)
+
+
+class FakeCursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None, prepare=None):
+        if self.conn.fail:
+            self.conn.fail = False
+            raise psycopg.errors.InternalError("injected statement failure")
+        self.conn.statements += 1
+        self.conn.params += len(params) if params else 0
+        # a row of a multi-row insert opens with (%s, or (%b when it's bound in binary
+        rows = len(params[0]) if "unnest" in query else query.count("(%")
+        if self.conn.row_conflict and self.conn.random.random() < 1 - (1 - self.conn.row_conflict) ** rows:
+            self.conn.failures += 1
+            self.conn.round_trip(rows)
+            raise psycopg.errors.SerializationFailure("restart transaction: TransactionRetryWithProtoRefreshError")
+        match = re.search(r"INSERT INTO (\w+)", query)
+        if match:
+            self.conn.table_statements[match[1]] += 1
+            self.conn.table_rows[match[1]] += rows
+        if "DO UPDATE" in query:
+            self.conn.conflicts["update"] += 1
+        elif "DO NOTHING" in query:
+            self.conn.conflicts["nothing"] += 1
+        if self.conn.log is not None:
+            self.conn.log.append((query, params))
+        self.conn.round_trip(rows)
+        return self
+
+    def fetchone(self):
+        return ("stand-in connection",)
+
+    def copy(self, statement):
+        self.conn.statements += 1
+        table = re.search(r"COPY (\w+)", statement)[1]
+        self.conn.table_statements[table] += 1
+        return FakeCopy(self.conn, table)
+
+
+class FakeCopy:
+
+    def __init__(self, conn, table):
+        self.conn = conn
+        self.table = table
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        conn = self.conn
+        if exc[0] is None and conn.row_conflict and conn.random.random() < 1 - (1 - conn.row_conflict) ** self.rows:
+            conn.failures += 1
+            conn.round_trip(self.rows)
+            raise psycopg.errors.SerializationFailure("restart transaction: TransactionRetryWithProtoRefreshError")
+        conn.round_trip(self.rows)
+        return False
+
+    def write_row(self, row):
+        self.rows += 1
+        self.conn.params += len(row)
+        self.conn.table_rows[self.table] += 1
+
+
+# writes the numpy generator output to pipe delimited files with the layout
+# datagen.py uses, one transactions file per profile under {folder}/0,
+# the transactions are seeded as well so the same arguments give the same corpus
+def write_corpus(folder, customers, days):
+    workload = Transaction({"customers": customers, "days": days, "generator": "numpy"})
+    workload.id = 0
+    workload.rng = np.random.default_rng(0)
+    workload.loop()
+    workload.start_date = datetime.datetime(2024, 1, 1)
+    workload.end_date = workload.start_date + datetime.timedelta(days=days)
+    workload.parse(None)
+
+    directory = os.path.join(folder, "0")
+    os.makedirs(directory, exist_ok=True)
+    files = {}
+    try:
+        for record in workload.records:
+            profile = record[Field.profile.value]
+            if profile not in files:
+                files[profile] = open(os.path.join(directory, profile.replace(".json", ".csv")), "w")
+                files[profile].write(HEADER + "\n")
+            files[profile].write("|".join(record[:-1]) + "\n")
+    finally:
+        for file in files.values():
+            file.close()
+    return folder
+
+
+# wraps the parsed records and counts the rows as they're consumed
+class CountedRecords:
+
+    def __init__(self, records):
+        self.records = records
+        self.rows = 0
+
+    def __iter__(self):
+        for record in self.records:
+            self.rows += 1
+            yield record
+
+
+# returns a workload that parses the corpus in folder, without running loop()
+def corpus_workload(folder, **args):
+    workload = Transaction(dict(args, data_folder=folder))
+    workload.id = 0
+    return workload
+
+
+# runs a single loop() and parse() for the workload and drains the records
+# to measure how many rows per second the generator produces
+def generate(args):
+    workload_args = {
+        "customers": args.customers,
+        "days": args.days,
+    }
+    if args.generator_location:
+        workload_args["generator_location"] = args.generator_location
+    if args.data_folder:
+        workload_args["data_folder"] = args.data_folder
+
+    generators = ["numpy"]
+    if os.path.exists(os.path.join(Transaction(workload_args).generator_location, "datagen.py")):
+        generators.append("sparkov")
+    else:
+        print("datagen.py not found in generator_location, skipping the sparkov generator")
+
+    for generator in generators:
+        workload = Transaction(dict(workload_args, generator=generator))
+        workload.id = 0
+        start = time.perf_counter()
+        workload.loop()
+        workload.parse(None)
+        rows = sum(1 for record in workload.records)
+        elapsed = time.perf_counter() - start
+        print(f"{generator:>8}: {rows} rows in {elapsed:.3f}s = {rows / elapsed:,.0f} rows/s")
+
+
+# compares peak python memory of materializing every parsed row
+# with streaming the rows through transact() as the window grows
+def memory(args):
+    for days in args.days:
+        with tempfile.TemporaryDirectory() as folder:
+            write_corpus(folder, args.customers, days)
+
+            workload = corpus_workload(folder, batch_size=args.batch_size)
+            tracemalloc.start()
+            workload.parse(None)
+            rows = len(list(workload.records))
+            materialized = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            workload = corpus_workload(folder, batch_size=args.batch_size)
+            conn = FakeConnection()
+            tracemalloc.start()
+            workload.parse(conn)
+            workload.transact(conn)
+            streamed = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        print(f"days: {days:>4} rows: {rows:>8} materialized peak: {materialized / 2**20:8.1f} MiB"
+              f" streamed peak: {streamed / 2**20:6.1f} MiB")
+
+
+# compares rows per second of the insert and copy load modes at several batch sizes,
+# against the database at --url or, without it, just the client side with a stand-in connection
+def load(args):
+    with tempfile.TemporaryDirectory() as folder:
+        write_corpus(folder, args.customers, args.days)
+        for batch_size in args.batch_size:
+            for load_mode in ["insert", "copy"]:
+                workload = corpus_workload(folder, batch_size=batch_size,
+                    copy_size=batch_size, load_mode=load_mode)
+                conn = psycopg.connect(args.url, autocommit=True) if args.url else FakeConnection()
+                try:
+                    workload.parse(conn)
+                    workload.records = CountedRecords(workload.records)
+                    start = time.perf_counter()
+                    workload.transact(conn)
+                    elapsed = time.perf_counter() - start
+                    rows = workload.records.rows
+                finally:
+                    if args.url:
+                        conn.close()
+                print(f"batch_size: {batch_size:>6} load_mode: {load_mode:>6}"
+                      f" {rows} rows in {elapsed:.3f}s = {rows / elapsed:,.0f} rows/s")
+
+
+# compares the wall clock time of flushing the batches serially and pipelined,
+# against the database at --url or a stand-in connection with --latency milliseconds per round trip
+def flush(args):
+    with tempfile.TemporaryDirectory() as folder:
+        write_corpus(folder, args.customers, args.days)
+        for flush_mode in ["serial", "pipeline"]:
+            workload = corpus_workload(folder, batch_size=args.batch_size, flush_mode=flush_mode)
+            if args.url:
+                conn = psycopg.connect(args.url, autocommit=True)
+            else:
+                conn = FakeConnection(latency=args.latency / 1000)
+            try:
+                workload.parse(conn)
+                workload.records = CountedRecords(workload.records)
+                start = time.perf_counter()
+                workload.transact(conn)
+                elapsed = time.perf_counter() - start
+            finally:
+                if args.url:
+                    conn.close()
+            rows = workload.records.rows
+            print(f"flush_mode: {flush_mode:>8} {rows} rows in {elapsed:.3f}s = {rows / elapsed:,.0f} rows/s")
+
+
+# reports the statements and average rows per statement sent for each table
+def batching(args):
+    with tempfile.TemporaryDirectory() as folder:
+        write_corpus(folder, args.customers, args.days)
+        workload = corpus_workload(folder, batch_size=args.batch_size)
+        conn = FakeConnection()
+        workload.parse(conn)
+        workload.transact(conn)
+    for table, statements in conn.table_statements.items():
+        rows = conn.table_rows[table]
+        print(f"{table:>12}: {statements:>6} statements {rows:>8} rows"
+              f" = {rows / statements:8.1f} rows per statement")
+
+
+# compares the dimension rows sent over several windows with and without the change detection cache
+def cache(args):
+    for cache_size in [0, args.cache_size]:
+        workload = Transaction({"customers": args.customers, "days": args.days,
+            "generator": "numpy", "cache_size": cache_size})
+        workload.id = 0
+        conn = FakeConnection()
+        for window in range(args.windows):
+            workload.loop()
+            workload.parse(conn)
+            workload.transact(conn)
+        print(f"cache_size: {cache_size:>7} " + " ".join(
+            f"{table}: {conn.table_rows[table]}" for table in ["address", "city_loc", "customer", "merchant"]))
+
+
+# compares lines per second of the row and columnar parse modes on the same corpus
+def parse(args):
+    with tempfile.TemporaryDirectory() as folder:
+        write_corpus(folder, args.customers, args.days)
+        for parse_mode in ["rows", "columnar"]:
+            workload = corpus_workload(folder, parse_mode=parse_mode)
+            start = time.perf_counter()
+            workload.parse(None)
+            lines = sum(1 for record in workload.records)
+            elapsed = time.perf_counter() - start
+            print(f"parse_mode: {parse_mode:>8} {lines} lines in {elapsed:.3f}s = {lines / elapsed:,.0f} lines/s")
+
+
+# runs a phase and returns its result with the elapsed seconds and the peak python memory,
+# the phase is run a second time under tracemalloc so tracing doesn't skew the timing
+def measure(phase):
+    start = time.perf_counter()
+    result = phase()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    phase()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+# runs every scenario of batch size, update frequency and key skew against a seeded corpus
+# and a stand-in connection, then writes the results per phase as json so runs can be compared
+def suite(args):
+    # the same number of rows spread over many customers or repeated for a few
+    skews = {"low": (args.customers, args.days), "high": (max(1, args.customers // 20), args.days * 20)}
+    results = []
+    for skew, (customers, days) in skews.items():
+        with tempfile.TemporaryDirectory() as folder:
+            write_corpus(folder, customers, days)
+            for batch_size in args.batch_size:
+                for update_freq in args.update_freq:
+                    workload = corpus_workload(folder, batch_size=batch_size, update_freq=update_freq)
+
+                    def parse_phase():
+                        workload.parse(None)
+                        return list(workload.records)
+                    records, parse_elapsed, parse_peak = measure(parse_phase)
+
+                    def transact_phase():
+                        conn = FakeConnection()
+                        workload.records = records
+                        workload.transact(conn)
+                        return conn
+                    conn, transact_elapsed, transact_peak = measure(transact_phase)
+
+                    rows = len(records)
+                    result = {
+                        "skew": skew,
+                        "customers": customers,
+                        "days": days,
+                        "batch_size": batch_size,
+                        "update_freq": update_freq,
+                        "rows": rows,
+                        "parse": {
+                            "seconds": parse_elapsed,
+                            "rows_per_second": rows / parse_elapsed,
+                            "peak_memory": parse_peak,
+                        },
+                        "transact": {
+                            "seconds": transact_elapsed,
+                            "rows_per_second": rows / transact_elapsed,
+                            "peak_memory": transact_peak,
+                            "statements": conn.statements,
+                            "statements_per_1k_rows": conn.statements * 1000 / rows,
+                            "update_statements": conn.conflicts["update"],
+                            "do_nothing_statements": conn.conflicts["nothing"],
+                            "tables": {
+                                table: {
+                                    "statements": statements,
+                                    "rows": conn.table_rows[table],
+                                    "rows_per_statement": conn.table_rows[table] / statements,
+                                } for table, statements in conn.table_statements.items()
+                            },
+                        },
+                    }
+                    results.append(result)
+                    print(f"skew: {skew:>4} batch_size: {batch_size:>5} update_freq: {update_freq:>3}"
+                          f" parse: {result['parse']['rows_per_second']:>9,.0f} rows/s"
+                          f" transact: {result['transact']['rows_per_second']:>9,.0f} rows/s"
+                          f" {result['transact']['statements_per_1k_rows']:6.1f} statements/1k rows")
+
+    with open(args.output, "w") as file:
+        json.dump({
+            "timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "workload": Transaction.__name__,
+            "results": results,
+        }, file, indent=2)
+    print(f"results written to {args.output}")
+
+
+# compares rows per second of parse and transact with the metrics off and on
+def metrics(args):
+    with tempfile.TemporaryDirectory() as folder:
+        write_corpus(folder, args.customers, args.days)
+        for metrics_folder in ["", os.path.join(folder, "metrics")]:
+            elapsed = []
+            for run in range(args.runs):
+                workload = corpus_workload(folder, batch_size=args.batch_size, metrics_folder=metrics_folder)
+                conn = FakeConnection()
+                start = time.perf_counter()
+                workload.parse(conn)
+                workload.records = CountedRecords(workload.records)
+                workload.transact(conn)
+                elapsed.append(time.perf_counter() - start)
+            rows = workload.records.rows
+            print(f"metrics: {'on' if metrics_folder else 'off':>3} {rows} rows"
+                  f" best of {args.runs} = {rows / min(elapsed):,.0f} rows/s")
+
+
+# compares a static batch size with batch sizes adapted to a latency slo,
+# over a stand-in connection that takes --latency ms per statement plus --row_latency ms per row
+def adaptive(args):
+    with tempfile.TemporaryDirectory() as folder:
+        write_corpus(folder, args.customers, args.days)
+        for batch_slo in [0, args.batch_slo]:
+            workload = corpus_workload(folder, batch_size=args.batch_size, batch_slo=batch_slo,
+                batch_min=args.batch_min, batch_max=args.batch_max)
+            conn = FakeConnection(latency=args.latency / 1000, row_latency=args.row_latency / 1000)
+            workload.parse(conn)
+            workload.records = CountedRecords(workload.records)
+            start = time.perf_counter()
+            workload.transact(conn)
+            elapsed = time.perf_counter() - start
+            rows = workload.records.rows
+            print(f"batch_slo: {batch_slo:>5}ms {rows} rows in {elapsed:.3f}s = {rows / elapsed:,.0f} rows/s"
+                  f" {conn.statements} statements, batch sizes " + " ".join(
+                      f"{table}: {size}" for table, size in workload.batch_sizes.items()))
+
+
+# compares the goodput with and without retrying serialization failures,
+# over a stand-in connection where each row conflicts with probability --row_conflict
+def retry(args):
+    with tempfile.TemporaryDirectory() as folder:
+        write_corpus(folder, args.customers, args.days)
+        for retry_max in [0, args.retry_max]:
+            workload = corpus_workload(folder, batch_size=args.batch_size, retry_max=retry_max,
+                retry_base=args.retry_base, split_after=args.split_after)
+            conn = FakeConnection(latency=args.latency / 1000, row_conflict=args.row_conflict)
+            workload.parse(conn)
+            start = time.perf_counter()
+            try:
+                workload.transact(conn)
+                outcome = "completed"
+            except psycopg.errors.SerializationFailure:
+                outcome = "failed"
+            elapsed = time.perf_counter() - start
+            rows = sum(conn.table_rows.values())
+            print(f"retry_max: {retry_max} {outcome} {rows} rows written in {elapsed:.3f}s"
+                  f" = {rows / elapsed:,.0f} rows/s, {conn.failures} serialization failures, " + ", ".join(
+                      f"{outcome}: {sum(c for (t, o), c in workload.retries.items() if o == outcome)}"
+                      for outcome in ["retry", "split", "give_up"]))
+
+
+# compares the wall clock time of several windows generated in loop() and prefetched by a
+# background thread. datagen.py is stood in for by a copy of the corpus that takes --datagen
+# seconds, like the subprocess it runs outside the GIL, and each statement takes --latency ms.
+# with --fail_window the stand-in fails once for that window, and the windows after it still run.
+# --fail_statement fails the first statement of a window and --fail_parse fails the parsing
+# of a window after its first chunk, together the producer fails while the window is skipped
+def prefetch(args):
+    with tempfile.TemporaryDirectory() as folder:
+        corpus = write_corpus(os.path.join(folder, "corpus"), args.customers, args.days)
+
+        # the stand-in is called once per window, in window order
+        calls = collections.Counter()
+
+        def run_datagen(target, start_date, end_date):
+            time.sleep(args.datagen)
+            calls[prefetch] += 1
+            if calls[prefetch] == args.fail_window + 1:
+                raise RuntimeError(f"datagen.py failed for window {args.fail_window}")
+            shutil.rmtree(target, ignore_errors=True)
+            shutil.copytree(os.path.join(corpus, "0"), target)
+
+        for prefetch in [0, args.prefetch]:
+            workload = corpus_workload(os.path.join(folder, "data"),
+                batch_size=args.batch_size, prefetch=prefetch)
+            workload.run_datagen = run_datagen
+
+            def read_files(directory, read_files=workload.read_files, prefetch=prefetch):
+                calls[prefetch, "parse"] += 1
+                window = calls[prefetch, "parse"] - 1
+                for row, record in enumerate(read_files(directory)):
+                    if window == args.fail_parse and row == PREFETCH_CHUNK:
+                        raise RuntimeError(f"parsing failed for window {window}")
+                    yield record
+
+            workload.read_files = read_files
+            conn = FakeConnection(latency=args.latency / 1000)
+            rows = 0
+            errors = 0
+            start = time.perf_counter()
+            for window in range(args.windows):
+                try:
+                    workload.loop()
+                    workload.parse(conn)
+                    workload.records = CountedRecords(workload.records)
+                    conn.fail = window == args.fail_statement
+                    workload.transact(conn)
+                    rows += workload.records.rows
+                except (RuntimeError, psycopg.Error):
+                    errors += 1
+            elapsed = time.perf_counter() - start
+            print(f"prefetch: {prefetch:>7} {args.windows} windows {rows} rows in {elapsed:.3f}s"
+                  f" = {rows / elapsed:,.0f} rows/s" + (f", {errors} failed windows" if errors else ""))
+
+
+# compares the time to the first row and the rows per second of generating a window
+# with replaying it from a saved dataset, the first replay includes saving the dataset
+def dataset(args):
+    with tempfile.TemporaryDirectory() as folder:
+        for name, dataset in [("generate", ""), ("save", "bench"), ("replay", "bench")]:
+            workload = Transaction({"customers": args.customers, "days": args.days,
+                "generator": "numpy", "data_folder": folder, "dataset": dataset})
+            workload.id = 0
+            start = time.perf_counter()
+            workload.loop()
+            workload.parse(None)
+            records = iter(workload.records)
+            next(records)
+            first = time.perf_counter() - start
+            rows = 1 + sum(1 for record in records)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>8}: first row after {first:.3f}s, {rows} rows in {elapsed:.3f}s"
+                  f" = {rows / elapsed:,.0f} rows/s")
+
+
+# compares the python memory per row of holding the parsed records as lists of values,
+# as the prefetch queue used to, and as RecordBlocks, and how fast transact() writes each of them
+def records(args):
+    with tempfile.TemporaryDirectory() as folder:
+        write_corpus(folder, args.customers, args.days)
+        for store in ["rows", "blocks"]:
+            workload = corpus_workload(folder, batch_size=args.batch_size)
+            workload.parse(None)
+            tracemalloc.start()
+            if store == "rows":
+                held = list(workload.records)
+                rows = len(held)
+            else:
+                held = []
+                chunk = []
+                for record in workload.records:
+                    chunk.append(record)
+                    if len(chunk) >= PREFETCH_CHUNK:
+                        held.append(RecordBlock(chunk))
+                        chunk = []
+                held.append(RecordBlock(chunk))
+                chunk = None
+                rows = sum(len(block) for block in held)
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            workload.records = held if store == "rows" else (row for block in held for row in block)
+            start = time.perf_counter()
+            workload.transact(FakeConnection())
+            elapsed = time.perf_counter() - start
+            print(f"{store:>6}: {rows} rows {size / rows:,.0f} bytes per row,"
+                  f" transact {rows / elapsed:,.0f} rows/s")
+
+
+# compares autocommit, where every statement commits on its own, with explicit transactions
+# of several batches, over a stand-in connection where a commit takes --commit_latency ms
+def commit(args):
+    with tempfile.TemporaryDirectory() as folder:
+        write_corpus(folder, args.customers, args.days)
+        for commit_batches in [0] + args.commit_batches:
+            workload = corpus_workload(folder, batch_size=args.batch_size, commit_batches=commit_batches)
+            conn = FakeConnection(latency=args.latency / 1000, commit_latency=args.commit_latency / 1000)
+            workload.parse(conn)
+            workload.records = CountedRecords(workload.records)
+            start = time.perf_counter()
+            workload.transact(conn)
+            elapsed = time.perf_counter() - start
+            rows = workload.records.rows
+            print(f"commit_batches: {commit_batches:>3} {rows} rows in {elapsed:.3f}s = {rows / elapsed:,.0f} rows/s,"
+                  f" {conn.commits} commits, {rows / conn.commits:.1f} rows per commit")
+
+
+# compares multi-row inserts with unnest statements, each with and without the prepared statement
+# cache, by the distinct statements the server has to parse and plan and the sql text sent,
+# and by the rows per second and cache hit rate against the database at --url
+def statements(args):
+    with tempfile.TemporaryDirectory() as folder:
+        write_corpus(folder, args.customers, args.days)
+        for statement_mode in ["values", "unnest"]:
+            for statement_cache in [0, args.statement_cache]:
+                options = dict(batch_size=args.batch_size, statement_mode=statement_mode,
+                    batch_slo=args.batch_slo, statement_cache=statement_cache)
+                workload = corpus_workload(folder, **options)
+                conn = FakeConnection(record=True)
+                workload.parse(conn)
+                with contextlib.redirect_stdout(None):
+                    workload.transact(conn)
+                texts = collections.Counter(query for query, params in conn.log)
+                sql = sum(len(query) for query, params in conn.log)
+                line = (f"statement_mode: {statement_mode:>6} statement_cache: {statement_cache:>3}"
+                        f" {len(conn.log)} statements, {len(texts)} distinct,"
+                        f" {sql / len(conn.log):,.0f} bytes of sql per statement")
+                if statement_cache:
+                    line += f", {workload.statement_hits / len(conn.log):.1%} cache hits"
+
+                if args.url:
+                    workload = corpus_workload(folder, **options)
+                    with psycopg.connect(args.url, autocommit=True) as conn:
+                        workload.parse(conn)
+                        workload.records = CountedRecords(workload.records)
+                        start = time.perf_counter()
+                        with contextlib.redirect_stdout(None):
+                            workload.transact(conn)
+                        elapsed = time.perf_counter() - start
+                    rows = workload.records.rows
+                    line += f", {rows} rows in {elapsed:.3f}s = {rows / elapsed:,.0f} rows/s"
+                print(line)
+
+
+# compares the ranges of the pre-split transaction table each batch touches with server side keys,
+# where the stand-in draws the leading hex digit of a gen_random_uuid() for each row it's sent, and
+# with client side keys batched by range, where the ranges the thread owns are those of thread 0 of --threads
+def ranges(args):
+    with tempfile.TemporaryDirectory() as folder:
+        write_corpus(folder, args.customers, args.days)
+        server = random.Random(0)
+        for key_mode, ranges in [("server", "all"), ("client", "all"), ("client", "owned")]:
+            workload = corpus_workload(folder, batch_size=args.batch_size, key_mode=key_mode, ranges=ranges)
+            conn = FakeConnection(record=True)
+            with contextlib.redirect_stdout(None):
+                workload.setup(conn, 0, args.threads)
+                workload.parse(conn)
+                workload.transact(conn)
+            if key_mode == "server":
+                batches = [query.count("(%") for query, params in conn.log if "INTO transaction" in query]
+                touched = sum(len({server.getrandbits(4) for row in range(rows)}) for rows in batches) / len(batches)
+            else:
+                batches = range(workload.range_batches)
+                touched = workload.range_count / workload.range_batches
+            rows = conn.table_rows["transaction"]
+            print(f"key_mode: {key_mode:>6} ranges: {ranges:>5} {len(batches)} batches"
+                  f" {rows / len(batches):6.1f} rows per batch, {touched:5.2f} ranges per batch")
+
+
+# sends the transaction rows at --rate rows per second over a stand-in connection that stalls
+# for --stall ms every --stall_every round trips, and compares the latency percentiles measured
+# from when each batch was due with those measured from when it was sent
+def rate(args):
+    with tempfile.TemporaryDirectory() as folder:
+        write_corpus(folder, args.customers, args.days)
+        workload = corpus_workload(folder, batch_size=args.batch_size, rate=args.rate, flush_mode=args.flush_mode)
+        conn = FakeConnection(latency=args.latency / 1000, stall=args.stall / 1000, stall_every=args.stall_every)
+        with contextlib.redirect_stdout(None):
+            workload.parse(conn)
+            workload.transact(conn)
+        workload.report_schedule()
+
+
+# runs --threads workers over the same corpus, as every thread's datagen.py generates the same
+# seeded customers, and counts the keys of each dimension table upserted by more than one worker
+def partition(args):
+    with tempfile.TemporaryDirectory() as folder:
+        write_corpus(folder, args.customers, args.days)
+        for id in range(1, args.threads):
+            shutil.copytree(os.path.join(folder, "0"), os.path.join(folder, str(id)))
+        for key_space in ["shared", "partitioned"]:
+            writers = collections.defaultdict(collections.Counter)
+            for id in range(args.threads):
+                workload = corpus_workload(folder, batch_size=args.batch_size, key_space=key_space)
+                conn = FakeConnection(record=True)
+                with contextlib.redirect_stdout(None):
+                    workload.setup(conn, id, args.threads)
+                    workload.parse(conn)
+                    workload.transact(conn)
+                keys = collections.defaultdict(set)
+                for query, params in conn.log:
+                    match = re.search(r"INSERT INTO (\w+)", query)
+                    if match and match[1] != "transaction":
+                        fields = len(params) // query.count("(%s")
+                        keys[match[1]].update(params[::fields])
+                for table, written in keys.items():
+                    writers[table].update(written)
+            print(f"key_space: {key_space:>11} " + ", ".join(
+                f"{table}: {sum(1 for count in keys.values() if count > 1)} of {len(keys)} keys"
+                f" written by more than one worker" for table, keys in writers.items()))
+
+
+# generates a window with each key skew and the same run_seed, then compares how many of the
+# rows go to the busiest 1% of the customers, zips and merchants and the dimension rows sent
+def skew(args):
+    for skew in ["uniform", "zipf", "hotspot"]:
+        workload = Transaction({"customers": args.customers, "days": args.days, "generator": "numpy",
+            "batch_size": args.batch_size, "cache_size": args.cache_size, "skew": skew, "run_seed": 1,
+            "zipf_s": args.zipf_s, "hot_fraction": args.hot_fraction, "hot_share": args.hot_share})
+        conn = FakeConnection()
+        with contextlib.redirect_stdout(None):
+            workload.setup(conn, 0, 1)
+            workload.loop()
+        workload.start_date = datetime.datetime(2024, 1, 1)
+        workload.end_date = workload.start_date + datetime.timedelta(days=args.days)
+        workload.parse(conn)
+        held = list(workload.records)
+        shares = []
+        for field in [Field.ssn, Field.zip, Field.merchant]:
+            counts = sorted(collections.Counter(record[field.value] for record in held).values(), reverse=True)
+            top = max(1, len(counts) // 100)
+            shares.append(f"{field.name} {sum(counts[:top]) / len(held):6.1%}")
+        workload.records = held
+        with contextlib.redirect_stdout(None):
+            workload.transact(conn)
+        dimensions = sum(rows for table, rows in conn.table_rows.items() if table != "transaction")
+        print(f"skew: {skew:>7} {len(held)} rows, top 1% of keys: " + ", ".join(shares)
+              + f", dimension rows sent per row: {dimensions / len(held):.3f}")
+
+
+# parses the corpus one line at a time and with the process pool of the parallel parse mode,
+# and compares the bytes a chunk of parsed rows takes to send back as lists and as a RecordBlock
+def parallel(args):
+    with tempfile.TemporaryDirectory() as folder:
+        write_corpus(folder, args.customers, args.days)
+        directory = os.path.join(folder, "0")
+        filepath = os.path.join(directory, max(os.listdir(directory),
+            key=lambda name: os.path.getsize(os.path.join(directory, name))))
+        block = Transaction.read_chunk(filepath, 0, min(PARSE_CHUNK, os.path.getsize(filepath)))
+        # the rows are copied one at a time so they don't share the values the block stores once
+        lists = [pickle.loads(pickle.dumps(list(row))) for row in block]
+        print(f"chunk of {len(block)} rows pickled as lists: {len(pickle.dumps(lists)) / len(block):,.0f}"
+              f" bytes per row, as a RecordBlock: {len(pickle.dumps(block)) / len(block):,.0f} bytes per row")
+
+        for parse_cpus in [0] + args.parse_cpus:
+            workload = corpus_workload(folder, parse_mode="parallel" if parse_cpus else "rows", parse_cpus=parse_cpus)
+            with contextlib.redirect_stdout(None):
+                workload.parse(None)
+                start = time.perf_counter()
+                rows = sum(1 for record in workload.records)
+                elapsed = time.perf_counter() - start
+            name = f"parallel parse_cpus {parse_cpus}" if parse_cpus else "rows"
+            print(f"{name:>24}: {rows} rows {rows / elapsed:,.0f} rows/s")
+            if workload.parse_pool is not None:
+                workload.parse_pool.shutdown()
+
+
+# compares binding the values as text and converted to their column types in binary, the rows per
+# second of parsing and writing a window over a stand-in connection, or the database at --url,
+# and the bytes of the parameters of the statements as psycopg sends them in each format
+def binary(args):
+    with tempfile.TemporaryDirectory() as folder:
+        write_corpus(folder, args.customers, args.days)
+        for param_format in ["text", "binary"]:
+            workload = corpus_workload(folder, batch_size=args.batch_size, param_format=param_format,
+                statement_mode=args.statement_mode)
+            conn = psycopg.connect(args.url, autocommit=True) if args.url else FakeConnection(record=True)
+            try:
+                start = time.perf_counter()
+                workload.parse(conn)
+                workload.records = CountedRecords(workload.records)
+                with contextlib.redirect_stdout(None):
+                    workload.transact(conn)
+                elapsed = time.perf_counter() - start
+                rows = workload.records.rows
+            finally:
+                if args.url:
+                    conn.close()
+            print(f"param_format: {param_format:>6} {rows} rows in {elapsed:.3f}s = {rows / elapsed:,.0f} rows/s", end="")
+            if args.url:
+                print()
+                continue
+            transformer = Transformer()
+            sent = 0
+            binary = 0
+            count = 0
+            for query, params in conn.log:
+                # each value is dumped in the format of its placeholder, %s leaves it to psycopg
+                # and %b asks for binary, and every parameter is sent with a 4 byte length
+                formats = [PyFormat(placeholder) for placeholder in re.findall(r"%([sbt])", query)]
+                sent += sum(4 + len(value) for value in transformer.dump_sequence(params, formats))
+                binary += sum(format == psycopg.pq.Format.BINARY for format in transformer.formats)
+                count += len(params)
+            print(f" parameters: {sent / rows:,.0f} bytes per row, {binary / count:.0%} sent in binary")
+
+
+# writes a synthetic changefeed in the cloud storage format to folder, files of --file_rows rows
+# for the tables in turn with a .RESOLVED checkpoint after every --checkpoint_files files.
+# the dimension tables upsert a limited set of ids so rows are updated between checkpoints,
+# and some customers are deleted
+def write_feed(folder, rows, file_rows, checkpoint_files):
+    rng = np.random.default_rng(0)
+    tables = ["transaction", "transaction", "transaction", "customer", "address", "merchant", "city_loc"]
+    ids = {table: [f"{i:08x}-0000-4000-8000-{table.encode().hex()[:12]:0>12}" for i in range(max(1, rows // 50))]
+        for table in tables}
+    wall = int(datetime.datetime(2024, 10, 18).timestamp()) * 10 ** 9
+    written = 0
+    files = 0
+    while written < rows:
+        wall += 10 ** 8
+        timestamp = time.strftime("%Y%m%d%H%M%S", time.gmtime(wall // 10 ** 9)) + f"{wall % 10 ** 9:09d}0000000000"
+        table = tables[files % len(tables)]
+        count = min(file_rows, rows - written)
+        numbers = rng.integers(2 ** 62, size=(count, 2)).tolist()
+        picks = rng.integers(len(ids[table]), size=count).tolist()
+        deletes = (rng.random(count) < 0.05).tolist()
+        lines = []
+        for i in range(count):
+            if table == "transaction":
+                id = f"{numbers[i][0]:016x}-0000-4000-8000-000000000000"
+                after = {"id": id, "cc_num": 10 ** 15 + numbers[i][1] % (9 * 10 ** 15), "merch_id": ids["merchant"][0],
+                    "trans_num": f"{numbers[i][1]:032x}", "trans_date": "2024-10-18", "trans_time": "12:40:28",
+                    "unix_time": wall // 10 ** 9, "category": "shopping_net", "amt": numbers[i][1] % 100000 / 100,
+                    "is_fraud": False}
+            else:
+                id = ids[table][picks[i]]
+                after = {"id": id, "acct_num": 10 ** 11 + numbers[i][0] % (9 * 10 ** 11), "street": "8047 Elm Ave",
+                    "zip": 33130, "lat": 25.7575, "lng": -80.2157, "ssn": f"{id[:3]}-{id[3:5]}-{id[5:8]}",
+                    "cc_num": 4967509732434210, "first": "Nancy", "last": "Brown", "gender": "F", "job": "Radiographer",
+                    "dob": "2004-05-17", "profile": "young_adults_female_urban.json",
+                    "merchant": "fraud_Taylor-Rodriguez Inc", "merch_lat": 25.997904, "merch_lng": -80.985852,
+                    "city": "Miami", "state": "FL", "city_pop": 442241}
+                if table == "customer" and deletes[i]:
+                    after = None
+            lines.append(json.dumps({"after": after, "key": [id], "updated": f"{wall}.0000000000",
+                "mvcc_timestamp": f"{wall}.0000000000"}))
+        with open(os.path.join(folder, f"{timestamp}-8d7f2d4e9c1a4b0f-1-2-00000000-{table}-1.ndjson"), "w") as file:
+            file.write("\n".join(lines) + "\n")
+        written += len(lines)
+        files += 1
+        if files % checkpoint_files == 0:
+            wall += 10 ** 8
+            timestamp = time.strftime("%Y%m%d%H%M%S", time.gmtime(wall // 10 ** 9)) + f"{wall % 10 ** 9:09d}0000000000"
+            with open(os.path.join(folder, f"{timestamp}.RESOLVED"), "w") as file:
+                json.dump({"resolved": f"{wall}.0000000000"}, file)
+    return files
+
+
+# resolves a synthetic changefeed to parquet with cdc.py, and for small feeds checks the result
+# against the correlated min and max subqueries of snowflake-cdc-config.sql done row by row in python
+def changefeed(args):
+    with tempfile.TemporaryDirectory() as folder:
+        feed = os.path.join(folder, "feed")
+        output = os.path.join(folder, "output")
+        os.makedirs(feed)
+        start = time.perf_counter()
+        files = write_feed(feed, args.rows, args.file_rows, args.checkpoint_files)
+        print(f"synthetic feed of {args.rows} rows in {files} files written in {time.perf_counter() - start:.1f}s")
+        cdc.resolve(argparse.Namespace(input=feed, output=output, tables=list(cdc.TABLE_TYPES),
+            versions=args.versions, row_group_size=100000, full=True))
+        if args.rows > 100000:
+            return
+
+        start = time.perf_counter()
+        names = os.listdir(feed)
+        checkpoints = [cdc.file_timestamp(name) for name in names if name.endswith(".RESOLVED")]
+        expected = collections.defaultdict(dict)
+        for name in sorted(names):
+            if not name.endswith(".ndjson"):
+                continue
+            timestamp = cdc.file_timestamp(name)
+            later = [checkpoint for checkpoint in checkpoints if checkpoint >= timestamp]
+            if not later:
+                continue
+            table = cdc.file_table(name, cdc.TABLE_TYPES)
+            with open(os.path.join(feed, name)) as file:
+                for line in file:
+                    row = json.loads(line)
+                    expected[(table, min(later))][row["key"][0]] = row["after"]
+        print(f"row by row resolution in {time.perf_counter() - start:.3f}s")
+        for (table, checkpoint), rows in expected.items():
+            written = cdc.pq.read_table(os.path.join(output, table, f"{checkpoint}.parquet"), columns=["id", "deleted"])
+            ids = dict(zip(written.column("id").to_pylist(), written.column("deleted").to_pylist()))
+            assert ids == {id: after is None for id, after in rows.items()}, (table, checkpoint)
+        print(f"parquet files match the row by row resolution for {len(expected)} tables and checkpoints")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="client side benchmarks for the transaction workload")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("generate", help="rows generated per second for each generator")
+    command.add_argument("--customers", type=int, default=100)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--generator_location")
+    command.add_argument("--data_folder")
+    command.set_defaults(func=generate)
+
+    command = commands.add_parser("memory", help="peak memory of parse and transact as days grows")
+    command.add_argument("--customers", type=int, default=100)
+    command.add_argument("--days", type=int, nargs="+", default=[5, 10, 20, 40])
+    command.add_argument("--batch_size", type=int, default=128)
+    command.set_defaults(func=memory)
+
+    command = commands.add_parser("load", help="rows per second of the insert and copy load modes")
+    command.add_argument("--url", help="connection string for a database with the transaction.sql schema")
+    command.add_argument("--customers", type=int, default=100)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--batch_size", type=int, nargs="+", default=[128, 512, 2048, 8192])
+    command.set_defaults(func=load)
+
+    command = commands.add_parser("flush", help="wall clock time of the serial and pipeline flush modes")
+    command.add_argument("--url", help="connection string for a database with the transaction.sql schema")
+    command.add_argument("--latency", type=float, default=20.0,
+        help="milliseconds per round trip for the stand-in connection")
+    command.add_argument("--customers", type=int, default=100)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--batch_size", type=int, default=128)
+    command.set_defaults(func=flush)
+
+    command = commands.add_parser("batching", help="average rows per statement for each table")
+    command.add_argument("--customers", type=int, default=100)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--batch_size", type=int, default=128)
+    command.set_defaults(func=batching)
+
+    command = commands.add_parser("cache", help="dimension rows sent with and without the cache")
+    command.add_argument("--customers", type=int, default=1000)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--windows", type=int, default=10)
+    command.add_argument("--cache_size", type=int, default=100000)
+    command.set_defaults(func=cache)
+
+    command = commands.add_parser("parse", help="lines per second of the row and columnar parse modes")
+    command.add_argument("--customers", type=int, default=1000)
+    command.add_argument("--days", type=int, default=10)
+    command.set_defaults(func=parse)
+
+    command = commands.add_parser("suite", help="every scenario of the offline benchmark, written as json")
+    command.add_argument("--customers", type=int, default=200)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--batch_size", type=int, nargs="+", default=[32, 128, 512])
+    command.add_argument("--update_freq", type=int, nargs="+", default=[0, 10, 100])
+    command.add_argument("--output", default="benchmark.json")
+    command.set_defaults(func=suite)
+
+    command = commands.add_parser("metrics", help="rows per second with the metrics off and on")
+    command.add_argument("--customers", type=int, default=1000)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--batch_size", type=int, default=128)
+    command.add_argument("--runs", type=int, default=5)
+    command.set_defaults(func=metrics)
+
+    command = commands.add_parser("adaptive", help="static and adaptive batch sizes over a simulated server")
+    command.add_argument("--customers", type=int, default=1000)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--batch_size", type=int, default=128)
+    command.add_argument("--batch_slo", type=float, default=50.0, help="milliseconds per statement")
+    command.add_argument("--batch_min", type=int, default=16)
+    command.add_argument("--batch_max", type=int, default=4096)
+    command.add_argument("--latency", type=float, default=5.0, help="milliseconds per statement")
+    command.add_argument("--row_latency", type=float, default=0.05, help="milliseconds per row")
+    command.set_defaults(func=adaptive)
+
+    command = commands.add_parser("retry", help="goodput with and without retrying serialization failures")
+    command.add_argument("--customers", type=int, default=1000)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--batch_size", type=int, default=128)
+    command.add_argument("--row_conflict", type=float, default=0.002)
+    command.add_argument("--retry_max", type=int, default=5)
+    command.add_argument("--retry_base", type=float, default=10.0)
+    command.add_argument("--split_after", type=int, default=2)
+    command.add_argument("--latency", type=float, default=1.0, help="milliseconds per statement")
+    command.set_defaults(func=retry)
+
+    command = commands.add_parser("prefetch", help="windows written with and without background pre-generation")
+    command.add_argument("--customers", type=int, default=1000)
+    command.add_argument("--days", type=int, default=5)
+    command.add_argument("--windows", type=int, default=5)
+    command.add_argument("--batch_size", type=int, default=128)
+    command.add_argument("--prefetch", type=int, default=100000, help="rows generated ahead")
+    command.add_argument("--datagen", type=float, default=1.0, help="seconds datagen.py takes per window")
+    command.add_argument("--fail_window", type=int, default=-1, help="window the stand-in datagen.py fails once for")
+    command.add_argument("--fail_statement", type=int, default=-1, help="window whose first statement fails")
+    command.add_argument("--fail_parse", type=int, default=-1, help="window that fails to parse after its first chunk")
+    command.add_argument("--latency", type=float, default=1.0, help="milliseconds per statement")
+    command.set_defaults(func=prefetch)
+
+    command = commands.add_parser("dataset", help="time to the first row generating and replaying a dataset")
+    command.add_argument("--customers", type=int, default=10000)
+    command.add_argument("--days", type=int, default=10)
+    command.set_defaults(func=dataset)
+
+    command = commands.add_parser("records", help="bytes per row of parsed records as lists and as blocks")
+    command.add_argument("--customers", type=int, default=1000)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--batch_size", type=int, default=128)
+    command.set_defaults(func=records)
+
+    command = commands.add_parser("commit", help="autocommit and explicit transactions of several batches")
+    command.add_argument("--customers", type=int, default=1000)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--batch_size", type=int, default=128)
+    command.add_argument("--commit_batches", type=int, nargs="+", default=[1, 4, 16])
+    command.add_argument("--latency", type=float, default=1.0, help="milliseconds per statement")
+    command.add_argument("--commit_latency", type=float, default=5.0, help="milliseconds per commit")
+    command.set_defaults(func=commit)
+
+    command = commands.add_parser("statements", help="distinct statements of multi-row inserts and unnest, prepared and not")
+    command.add_argument("--url", help="connection string for a database with the transaction.sql schema")
+    command.add_argument("--customers", type=int, default=1000)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--batch_size", type=int, default=128)
+    command.add_argument("--batch_slo", type=float, default=0.0,
+        help="milliseconds per statement, adaptive batch sizes send many more distinct statements")
+    command.add_argument("--statement_cache", type=int, default=64)
+    command.set_defaults(func=statements)
+
+    command = commands.add_parser("ranges", help="ranges of the transaction table touched per batch")
+    command.add_argument("--customers", type=int, default=1000)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--batch_size", type=int, default=128)
+    command.add_argument("--threads", type=int, default=4)
+    command.set_defaults(func=ranges)
+
+    command = commands.add_parser("rate", help="latency percentiles of an open loop schedule")
+    command.add_argument("--customers", type=int, default=1000)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--batch_size", type=int, default=128)
+    command.add_argument("--rate", type=float, default=10000, help="transaction rows per second")
+    command.add_argument("--latency", type=float, default=1.0, help="milliseconds per statement")
+    command.add_argument("--stall", type=float, default=200.0, help="milliseconds of a stall")
+    command.add_argument("--stall_every", type=int, default=100, help="round trips between stalls")
+    command.add_argument("--flush_mode", choices=["serial", "pipeline"], default="serial")
+    command.set_defaults(func=rate)
+
+    command = commands.add_parser("partition", help="dimension keys upserted by more than one worker")
+    command.add_argument("--customers", type=int, default=1000)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--batch_size", type=int, default=128)
+    command.add_argument("--threads", type=int, default=4)
+    command.set_defaults(func=partition)
+
+    command = commands.add_parser("skew", help="share of the rows going to the busiest keys with each key skew")
+    command.add_argument("--customers", type=int, default=1000)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--batch_size", type=int, default=128)
+    command.add_argument("--cache_size", type=int, default=10000)
+    command.add_argument("--zipf_s", type=float, default=1.1)
+    command.add_argument("--hot_fraction", type=float, default=0.01)
+    command.add_argument("--hot_share", type=float, default=0.9)
+    command.set_defaults(func=skew)
+
+    command = commands.add_parser("parallel", help="rows per second of parsing in a process pool")
+    command.add_argument("--customers", type=int, default=10000)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--parse_cpus", type=float, nargs="+", default=[0.5, 1.0])
+    command.set_defaults(func=parallel)
+
+    command = commands.add_parser("binary", help="rows per second and parameter bytes of text and binary binding")
+    command.add_argument("--url", help="connection string for a database with the transaction.sql schema")
+    command.add_argument("--customers", type=int, default=1000)
+    command.add_argument("--days", type=int, default=10)
+    command.add_argument("--batch_size", type=int, default=128)
+    command.add_argument("--statement_mode", choices=["values", "unnest"], default="values")
+    command.set_defaults(func=binary)
+
+    command = commands.add_parser("cdc", help="rows per second of resolving a synthetic changefeed to parquet")
+    command.add_argument("--rows", type=int, default=1000000)
+    command.add_argument("--file_rows", type=int, default=10000)
+    command.add_argument("--checkpoint_files", type=int, default=14)
+    command.add_argument("--versions", choices=["latest", "all"], default="latest")
+    command.set_defaults(func=changefeed)
+
+    args = parser.parse_args()
+    args.func(args)
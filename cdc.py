@@ -0,0 +1,251 @@
+# resolves the files of a cockroachdb changefeed in cloud storage format, copied from the bucket
+# in minio-config.env to a local folder, against the .RESOLVED checkpoints of the changefeed,
+# and writes the latest version of every row at each checkpoint as a parquet file per table,
+# like the checkpoint matching queries of snowflake-cdc-config.sql and snowflake-cdc-analysis.ipynb
+
+import argparse
+from bisect import bisect_left
+import json
+import numpy as np
+import os
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.json as pj
+    import pyarrow.parquet as pq
+except ImportError:
+    # pyarrow is needed to read the changefeed and write parquet
+    pa = None
+
+
+# the columns of the tables in transaction.sql as the changefeed writes them to json,
+# uuids, dates and times are strings and the dates are converted to dates once read
+TABLE_TYPES = {} if pa is None else {
+    "address": {
+        "id": pa.string(),
+        "acct_num": pa.int64(),
+        "street": pa.string(),
+        "zip": pa.int32(),
+        "lat": pa.float64(),
+        "lng": pa.float64(),
+    },
+    "city_loc": {
+        "id": pa.string(),
+        "zip": pa.int32(),
+        "city": pa.string(),
+        "state": pa.string(),
+        "city_pop": pa.int32(),
+    },
+    "customer": {
+        "id": pa.string(),
+        "ssn": pa.string(),
+        "cc_num": pa.int64(),
+        "first": pa.string(),
+        "last": pa.string(),
+        "gender": pa.string(),
+        "job": pa.string(),
+        "dob": pa.string(),
+        "acct_num": pa.int64(),
+        "profile": pa.string(),
+    },
+    "merchant": {
+        "id": pa.string(),
+        "merchant": pa.string(),
+        "merch_lat": pa.float64(),
+        "merch_lng": pa.float64(),
+    },
+    "transaction": {
+        "id": pa.string(),
+        "cc_num": pa.int64(),
+        "merch_id": pa.string(),
+        "trans_num": pa.string(),
+        "trans_date": pa.string(),
+        "trans_time": pa.string(),
+        "unix_time": pa.int32(),
+        "category": pa.string(),
+        "amt": pa.float64(),
+        "is_fraud": pa.bool_(),
+    },
+}
+
+# the date columns, read as strings and converted to dates
+DATE_COLUMNS = {"dob", "trans_date"}
+
+# the file of the output folder that remembers the last checkpoint written
+STATE_FILE = "_resolved"
+
+
+# the timestamp a changefeed file name starts with, 33 digits that sort like the times they stand for,
+# before the first - of a data file like 202410181200000000000000000-<uniquer>-<topic>-<schema>.ndjson
+# and before the . of a checkpoint like 202410181200000000000000000.RESOLVED
+def file_timestamp(filename):
+    return filename.split(".", 1)[0].split("-", 1)[0]
+
+
+# the table of a data file, the notebook matches the file names on -<table>-
+def file_table(filename, tables):
+    for table in tables:
+        if f"-{table}-" in filename:
+            return table
+    return None
+
+
+# finds the checkpoints and data files under folder, which may be split in date folders,
+# sorts them on their timestamps and assigns every data file to the first checkpoint at or
+# after it with a bisect, O(n log n) for n files instead of a subquery per row.
+# returns the checkpoints as (timestamp, resolved) and for each checkpoint index the data
+# files of each table in the order they were written, the files after the last checkpoint
+# aren't resolved yet and are left for the next run
+def assign(folder, tables):
+    checkpoints = []
+    files = []
+    for directory, subdirectories, filenames in os.walk(folder):
+        for filename in filenames:
+            filepath = os.path.join(directory, filename)
+            if filename.endswith(".RESOLVED"):
+                checkpoints.append((file_timestamp(filename), filepath))
+            elif filename.endswith(".ndjson"):
+                table = file_table(filename, tables)
+                if table is not None:
+                    files.append((file_timestamp(filename), filename, table, filepath))
+    checkpoints.sort()
+    files.sort()
+
+    timestamps = [timestamp for timestamp, filepath in checkpoints]
+    windows = {}
+    pending = 0
+    for timestamp, filename, table, filepath in files:
+        index = bisect_left(timestamps, timestamp)
+        if index == len(timestamps):
+            pending += 1
+            continue
+        windows.setdefault(index, {}).setdefault(table, []).append((timestamp, filepath))
+
+    resolved = []
+    for timestamp, filepath in checkpoints:
+        with open(filepath) as file:
+            resolved.append((timestamp, json.load(file)["resolved"]))
+    return resolved, windows, pending
+
+
+# reads the rows of a data file of a table with the file timestamp and the row number in the file,
+# a deleted row has no after, so its id is taken from its key
+def read_file(table, timestamp, filepath):
+    columns = TABLE_TYPES[table]
+    schema = pa.schema([
+        ("after", pa.struct(list(columns.items()))),
+        ("key", pa.list_(pa.string())),
+        ("updated", pa.string()),
+        ("mvcc_timestamp", pa.string()),
+    ])
+    rows = pj.read_json(filepath, parse_options=pj.ParseOptions(
+        explicit_schema=schema, unexpected_field_behavior="ignore"))
+    after = rows.column("after").combine_chunks()
+    values = dict(zip(columns, after.flatten()))
+    values["id"] = pc.coalesce(values["id"], pc.list_element(rows.column("key"), 0))
+    for name in DATE_COLUMNS & values.keys():
+        values[name] = pc.cast(values[name], pa.date32())
+    values["deleted"] = pc.is_null(after)
+    values["file_timestamp"] = pa.repeat(pa.scalar(timestamp), len(rows))
+    values["file_row_number"] = pa.array(np.arange(len(rows)))
+    values["mvcc_timestamp"] = rows.column("mvcc_timestamp")
+    values["updated"] = rows.column("updated")
+    return pa.table(values)
+
+
+# the last version of every id, the files are in the order they were written and so are the rows
+# of a file, so the last row of an id is its latest update, like the two idxmax reductions of the notebook
+def latest(rows):
+    order = pa.array(np.arange(len(rows)))
+    last = pa.table({"id": rows.column("id"), "order": order}).group_by("id").aggregate([("order", "max")])
+    indices = last.column("order_max")
+    return rows.take(pc.take(indices, pc.sort_indices(indices)))
+
+
+# adds the checkpoint a table's rows are resolved at
+def checkpointed(rows, timestamp, resolved):
+    rows = rows.append_column("cp_resolved", pa.repeat(pa.scalar(resolved), len(rows)))
+    return rows.append_column("cp_timestamp", pa.repeat(pa.scalar(timestamp), len(rows)))
+
+
+# writes the rows of a table for a checkpoint, with latest versions the files of the checkpoint are held
+# until the last version of each id is known, with all versions a file at a time is held. the parquet
+# file is written under a temporary name first, so a checkpoint file is either complete or missing
+def write_window(args, table, files, timestamp, resolved):
+    directory = os.path.join(args.output, table)
+    os.makedirs(directory, exist_ok=True)
+    filepath = os.path.join(directory, f"{timestamp}.parquet")
+    read = 0
+    if args.versions == "latest":
+        rows = pa.concat_tables([read_file(table, *file) for file in files])
+        read = len(rows)
+        rows = checkpointed(latest(rows), timestamp, resolved)
+        pq.write_table(rows, f"{filepath}.tmp", row_group_size=args.row_group_size)
+        written = len(rows)
+    else:
+        writer = None
+        for file in files:
+            rows = checkpointed(read_file(table, *file), timestamp, resolved)
+            if writer is None:
+                writer = pq.ParquetWriter(f"{filepath}.tmp", rows.schema)
+            writer.write_table(rows, row_group_size=args.row_group_size)
+            read += len(rows)
+        writer.close()
+        written = read
+    os.replace(f"{filepath}.tmp", filepath)
+    return read, written
+
+
+def resolve(args):
+    if pa is None:
+        raise ImportError("pyarrow is required for the cdc resolver")
+
+    start = time.perf_counter()
+    resolved, windows, pending = assign(args.input, args.tables)
+    assigned = time.perf_counter()
+    print(f"{len(resolved)} checkpoints, {sum(len(files) for tables in windows.values() for files in tables.values())}"
+          f" files assigned in {assigned - start:.3f}s, {pending} files wait for the next checkpoint")
+
+    state = os.path.join(args.output, STATE_FILE)
+    done = ""
+    if os.path.exists(state) and not args.full:
+        with open(state) as file:
+            done = file.read().strip()
+
+    rows_read = 0
+    rows_written = 0
+    for index in sorted(windows):
+        timestamp, checkpoint = resolved[index]
+        if timestamp <= done:
+            continue
+        for table, files in windows[index].items():
+            read, written = write_window(args, table, files, timestamp, checkpoint)
+            rows_read += read
+            rows_written += written
+        # the checkpoint is only remembered once all its tables are written
+        os.makedirs(args.output, exist_ok=True)
+        with open(f"{state}.tmp", "w") as file:
+            file.write(timestamp)
+        os.replace(f"{state}.tmp", state)
+
+    elapsed = time.perf_counter() - start
+    print(f"{rows_read} rows read and {rows_written} rows written in {elapsed:.3f}s"
+          f" = {rows_read / elapsed:,.0f} rows/s, peak arrow memory {pa.default_memory_pool().max_memory() / 2 ** 20:,.0f}MB")
+    return rows_read, rows_written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="resolves changefeed files against their checkpoints into parquet")
+    parser.add_argument("input", help="folder with the changefeed .ndjson and .RESOLVED files")
+    parser.add_argument("output", help="folder for a parquet file per table per checkpoint")
+    parser.add_argument("--tables", nargs="+", default=list(TABLE_TYPES))
+    parser.add_argument("--versions", choices=["latest", "all"], default="latest",
+        help="latest keeps the last version of every row at each checkpoint, all keeps every change")
+    parser.add_argument("--row_group_size", type=int, default=100000)
+    parser.add_argument("--full", action="store_true",
+        help="resolve every checkpoint again instead of the ones after the last run")
+
+    args = parser.parse_args()
+    resolve(args)
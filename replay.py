@@ -0,0 +1,147 @@
+# sends the statements of the capture logs the workload threads wrote with capture_folder
+# again, over several connections, either as fast as they go or at a multiple of the speed
+# they were captured at, so the writes can be repeated without generating and parsing the data
+
+import argparse
+import glob
+import heapq
+import os
+import psycopg
+import queue
+import random
+import threading
+import time
+
+if os.name == "nt":
+    from transactionwin import CaptureLog, LatencyHistogram
+else:
+    from transactionmac import CaptureLog, LatencyHistogram
+
+
+# the statements of every log merged in the order they were sent, with the time they were
+# sent moved to seconds since the first statement of all the logs
+def merged(filepaths):
+    logs = [CaptureLog.read(filepath) for filepath in filepaths]
+    first = None
+    for sent, sql, params in heapq.merge(*logs, key=lambda event: event[0]):
+        if first is None:
+            first = sent
+        yield sent - first, sql, params
+
+
+# a connection of the replay, takes the statements off the queue until it gets None
+class Replayer(threading.Thread):
+
+    def __init__(self, url, statements, retry_max):
+        super().__init__(daemon=True)
+        self.url = url
+        self.statements = statements
+        self.retry_max = retry_max
+        self.rows = 0
+        self.sent = 0
+        self.failures = 0
+        self.errors = 0
+        self.given_up = 0
+        self.scheduled_latency = LatencyHistogram()
+        self.service_latency = LatencyHistogram()
+
+    def run(self):
+        with psycopg.connect(self.url, autocommit=True) as conn:
+            while True:
+                event = self.statements.get()
+                if event is None:
+                    return
+                due, sql, params = event
+                start = time.perf_counter()
+                for attempt in range(self.retry_max + 1):
+                    try:
+                        self.rows += self.send(conn, sql, params)
+                        self.sent += 1
+                        break
+                    except psycopg.errors.SerializationFailure:
+                        self.failures += 1
+                        time.sleep(random.uniform(0, 10 * 2 ** attempt) / 1000)
+                    except psycopg.Error as e:
+                        self.errors += 1
+                        print(f"replay error: {e}")
+                        break
+                else:
+                    self.given_up += 1
+                    print(f"replay gave up on a statement after {self.retry_max} retries")
+                end = time.perf_counter()
+                self.service_latency.record(end - start)
+                self.scheduled_latency.record(end - (due or start))
+
+    # the statements are prepared, since a replay repeats few statements many times
+    def send(self, conn, sql, params):
+        with conn.cursor() as cur:
+            if sql.lstrip().startswith("COPY"):
+                fields, data = params
+                with cur.copy(sql) as copy:
+                    for i in range(0, len(data), fields):
+                        copy.write_row(data[i:i + fields])
+                return len(data) // fields
+            cur.execute(sql, params, prepare=True)
+            if "unnest" in sql:
+                return len(params[0])
+            return sql.count("(%")
+
+
+def replay(args):
+    filepaths = sorted(path for pattern in args.logs for path in glob.glob(pattern))
+    if not filepaths:
+        raise SystemExit(f"no capture logs match {' '.join(args.logs)}")
+
+    # a few statements per connection are queued ahead, so reading the logs keeps up
+    statements = queue.Queue(4 * args.connections)
+    replayers = [Replayer(args.url, statements, args.retry_max) for i in range(args.connections)]
+    for replayer in replayers:
+        replayer.start()
+
+    start = time.perf_counter()
+    for offset, sql, params in merged(filepaths):
+        due = None
+        if args.speed > 0:
+            due = start + offset / args.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        statements.put((due, sql, params))
+    for replayer in replayers:
+        statements.put(None)
+    for replayer in replayers:
+        replayer.join()
+    elapsed = time.perf_counter() - start
+
+    sent = sum(replayer.sent for replayer in replayers)
+    rows = sum(replayer.rows for replayer in replayers)
+    scheduled_latency = LatencyHistogram()
+    service_latency = LatencyHistogram()
+    for replayer in replayers:
+        for histogram, latency in [(scheduled_latency, replayer.scheduled_latency),
+                                   (service_latency, replayer.service_latency)]:
+            histogram.counts.update(latency.counts)
+            histogram.total += latency.total
+            histogram.max = max(histogram.max, latency.max)
+    print(f"replayed {sent} statements and {rows} rows from {len(filepaths)} logs over {args.connections}"
+          f" connections in {elapsed:.2f}s, {sent / elapsed:,.0f} statements/s {rows / elapsed:,.0f} rows/s")
+    print(f"serialization failures retried: {sum(replayer.failures for replayer in replayers)}"
+          f" given up: {sum(replayer.given_up for replayer in replayers)}"
+          f" errors: {sum(replayer.errors for replayer in replayers)}")
+    if args.speed > 0:
+        print(f"latency from schedule {scheduled_latency.report()}")
+    print(f"latency from send {service_latency.report()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="sends the statements of transaction workload capture logs again")
+    parser.add_argument("logs", nargs="+", help="capture logs, or glob patterns like 'captures/capture-*.log'")
+    parser.add_argument("--url", required=True, help="connection string for a database with the transaction.sql schema")
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--speed", type=float, default=0,
+        help="multiple of the captured timing, 2 sends twice as fast, 0 sends as fast as possible")
+    parser.add_argument("--retry_max", type=int, default=5,
+        help="attempts to resend a statement that failed with a serialization failure")
+
+    args = parser.parse_args()
+    replay(args)
@@ -1,13 +1,33 @@
+import atexit
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
 import datetime
 from datetime import timedelta
 from enum import Enum
+import json
+import numpy as np
+from operator import itemgetter
 import os
+import pickle
 import psycopg
+import queue
 import random
 import shutil
+import struct
 import subprocess
+import threading
 import time
 import uuid
+import zlib
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as csv
+except ImportError:
+    # pyarrow is only needed for the columnar parse mode
+    pa = None
 
 class Field(Enum):
     ssn = 0
@@ -39,6 +59,522 @@ class Field(Enum):
     merch_id = 26
 
 
+# the values each table takes from a record, in the order of the columns in its statement,
+# picked as a tuple in one call instead of indexing the record once per column
+ADDRESS_VALUES = itemgetter(Field.acct_num.value, Field.street.value, Field.zip.value,
+    Field.lat.value, Field.lng.value)
+CITY_LOC_VALUES = itemgetter(Field.zip.value, Field.city.value, Field.state.value, Field.city_pop.value)
+CUSTOMER_VALUES = itemgetter(Field.ssn.value, Field.cc_num.value, Field.first.value, Field.last.value,
+    Field.gender.value, Field.job.value, Field.dob.value, Field.acct_num.value, Field.profile.value)
+MERCHANT_VALUES = itemgetter(Field.merch_id.value, Field.merchant.value, Field.merch_lat.value,
+    Field.merch_lng.value)
+TRANSACTION_VALUES = itemgetter(Field.cc_num.value, Field.trans_num.value, Field.trans_date.value,
+    Field.trans_time.value, Field.unix_time.value, Field.category.value, Field.merch_id.value,
+    Field.amt.value, Field.is_fraud.value)
+
+
+# with partitioned keys every worker's accounts and cards are moved to a range of their own.
+# card numbers have up to 19 digits, most of the INT8 range already, so the cards share the
+# INT8 range out between the workers and a card is reduced to its worker's share
+ACCT_NUM_SPAN = 10 ** 12
+CC_NUM_MAX = 2 ** 63 - 1
+
+# the array type of each column bound by the unnest statements, in the order of the insert columns
+UNNEST_TYPES = {
+    "address": ["INT8", "TEXT", "INT4", "FLOAT8", "FLOAT8"],
+    "city_loc": ["INT4", "TEXT", "TEXT", "INT4"],
+    "customer": ["TEXT", "INT8", "TEXT", "TEXT", "TEXT", "TEXT", "DATE", "INT8", "TEXT"],
+    "merchant": ["UUID", "TEXT", "FLOAT8", "FLOAT8"],
+    "transaction": ["INT8", "TEXT", "DATE", "TIME", "INT4", "TEXT", "UUID", "FLOAT8", "BOOL"],
+}
+
+
+# a block of records kept column by column, every value is stored once per block and shared
+# by the rows that repeat it, like the customer, merchant and date columns of a customer's
+# transactions, and the rows are zipped back together as tuples when the block is iterated
+class RecordBlock:
+    __slots__ = ("columns", "rows")
+
+    def __init__(self, records):
+        self.rows = len(records)
+        self.columns = []
+        for column in zip(*records):
+            values = {}
+            self.columns.append(tuple([values.setdefault(value, value) for value in column]))
+
+    def __len__(self):
+        return self.rows
+
+    def __iter__(self):
+        return zip(*self.columns)
+
+
+# remembers a fingerprint of the last row sent for each key of a dimension table,
+# the least recently used keys are evicted once the cache holds size keys
+class DimensionCache:
+
+    def __init__(self, size: int):
+        self.size = size
+        self.rows = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # returns False if the row is the same as the last one sent for its key,
+    # otherwise remembers it as the last row sent and returns True
+    def changed(self, key, row) -> bool:
+        fingerprint = hash(row)
+        if self.rows.get(key) == fingerprint:
+            self.rows.move_to_end(key)
+            self.hits += 1
+            return False
+
+        self.misses += 1
+        self.rows[key] = fingerprint
+        self.rows.move_to_end(key)
+        if len(self.rows) > self.size:
+            self.rows.popitem(last=False)
+            self.evictions += 1
+        return True
+
+    def clear(self):
+        self.rows.clear()
+
+
+# adjusts the batch size of a table to keep its statements under a latency slo in seconds,
+# a full batch that finishes within half the slo grows the size by an eighth,
+# a statement over the slo or a failed one halves it, always within min_size and max_size
+class BatchController:
+
+    def __init__(self, size: int, min_size: int, max_size: int, slo: float):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.slo = slo
+        self.size = min(max(size, min_size), max_size)
+
+    def observe(self, seconds: float, rows: int):
+        if seconds > self.slo:
+            self.backoff()
+        elif seconds < self.slo / 2 and rows >= self.size:
+            self.size = min(self.max_size, self.size + max(1, self.size // 8))
+
+    def backoff(self):
+        self.size = max(self.min_size, self.size // 2)
+
+
+# counts latencies in log linear buckets like HdrHistogram, values below 128us get a bucket each
+# and above that every power of two is split in 64 buckets, so a bucket is within 1.6% of its values
+class LatencyHistogram:
+
+    def __init__(self):
+        self.counts = Counter()
+        self.total = 0
+        self.max = 0
+        self.sum = 0.0
+
+    def record(self, seconds: float):
+        self.sum += seconds
+        value = max(0, int(seconds * 1_000_000))
+        if value < 128:
+            index = value
+        else:
+            shift = value.bit_length() - 7
+            index = shift * 64 + (value >> shift)
+        self.counts[index] += 1
+        self.total += 1
+        self.max = max(self.max, value)
+
+    # the highest value in microseconds counted by a bucket
+    @staticmethod
+    def value(index: int) -> int:
+        if index < 128:
+            return index
+        shift = index // 64 - 1
+        return ((index - shift * 64 + 1) << shift) - 1
+
+    def percentile(self, percent: float) -> int:
+        rank = percent / 100 * self.total
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.value(index), self.max)
+        return self.max
+
+    def report(self) -> str:
+        return " ".join(f"p{percent:g}: {self.percentile(percent) / 1000:.2f}ms"
+            for percent in [50, 90, 99, 99.9]) + f" max: {self.max / 1000:.2f}ms"
+
+
+# appends the statements a workload thread sends to a binary log that replay.py can send again.
+# the log is a series of frames, each a length and a zlib compressed pickle of the sql of the
+# statements first seen in the frame and the (time sent, statement number, parameters) of
+# every statement, so the sql of a statement is written once however often it's sent
+class CaptureLog:
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.file = None
+        self.statements = {}
+        self.new_statements = {}
+        self.events = []
+        self.count = 0
+        self.bytes = 0
+
+    def record(self, sent: float, sql: str, params):
+        number = self.statements.get(sql)
+        if number is None:
+            number = self.statements[sql] = self.new_statements[sql] = len(self.statements)
+        self.events.append((sent, number, params))
+        self.count += 1
+        if len(self.events) >= CAPTURE_FRAME:
+            self.flush()
+
+    def flush(self):
+        if not self.events:
+            return
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.filepath) or ".", exist_ok=True)
+            self.file = open(self.filepath, "wb")
+            self.file.write(CAPTURE_MAGIC)
+        frame = zlib.compress(pickle.dumps(
+            ({number: sql for sql, number in self.new_statements.items()}, self.events),
+            protocol=pickle.HIGHEST_PROTOCOL), 1)
+        self.file.write(struct.pack("<I", len(frame)))
+        self.file.write(frame)
+        self.file.flush()
+        self.bytes += 4 + len(frame)
+        self.new_statements = {}
+        self.events = []
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    # yields the (time sent, sql, parameters) of every statement in a log, one frame at a time
+    @staticmethod
+    def read(filepath: str):
+        statements = {}
+        with open(filepath, "rb") as file:
+            if file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+                raise ValueError(f"{filepath} is not a capture log")
+            while header := file.read(4):
+                frame = file.read(struct.unpack("<I", header)[0])
+                new_statements, events = pickle.loads(zlib.decompress(frame))
+                statements.update(new_statements)
+                for sent, number, params in events:
+                    yield sent, statements[number], params
+
+
+# collects latency histograms and counters for a workload thread, and writes a snapshot of them
+# to a file in folder every interval seconds, either as prometheus text or json.
+# the histograms are the log linear LatencyHistogram the latencies are printed with, so the
+# percentiles of an exported histogram are the ones in the report
+class Metrics:
+
+    def __init__(self, folder: str, format: str, interval: float):
+        self.folder = folder
+        self.format = format
+        self.interval = interval
+        self.enabled = bool(folder)
+        self.thread = 0
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.written = time.monotonic()
+
+    def key(self, name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def observe(self, name, seconds, **labels):
+        key = self.key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LatencyHistogram()
+        histogram.record(seconds)
+        if time.monotonic() - self.written >= self.interval:
+            self.write()
+
+    def count(self, name, value=1, **labels):
+        key = self.key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        self.counters[self.key(name, labels)] = value
+
+    def gauge(self, name, value, **labels):
+        self.gauges[self.key(name, labels)] = value
+
+    # rows, statements and an estimate of the bytes sent for a statement,
+    # from its text and the size of the parameters of the first row times the rows
+    def count_statement(self, table, rows, statement, data):
+        self.count("rows_total", rows, table=table)
+        self.count("statements_total", table=table)
+        row = data[:len(data) // rows]
+        self.count("bytes_sent_total", len(statement) + rows * sum(
+            len(value) if isinstance(value, str) else 8 for value in row), table=table)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.enabled:
+                self.observe(name, time.perf_counter() - start, **labels)
+
+    # times how long the records take to produce, without the time spent by the consumer
+    def timed(self, records, name, **labels):
+        clock = time.perf_counter
+        elapsed = 0.0
+        start = clock()
+        for record in records:
+            elapsed += clock() - start
+            yield record
+            start = clock()
+        self.observe(name, elapsed + clock() - start, **labels)
+
+    def labels(self, labels, **extra):
+        labels = dict(labels, thread=self.thread, **extra)
+        return ",".join(f'{k}="{v}"' for k, v in labels.items())
+
+    def prometheus(self):
+        lines = []
+        for name in sorted({name for name, labels in self.histograms}):
+            lines.append(f"# TYPE workload_{name} histogram")
+            for (metric, labels), histogram in self.histograms.items():
+                if metric != name:
+                    continue
+                # only the buckets that counted something are written, a bucket holds
+                # the values below the microsecond after the highest one it counts
+                cumulative = 0
+                for index in sorted(histogram.counts):
+                    cumulative += histogram.counts[index]
+                    le = f"{(histogram.value(index) + 1) / 1e6:g}"
+                    lines.append(f"workload_{name}_bucket{{{self.labels(labels, le=le)}}} {cumulative}")
+                lines.append(f"workload_{name}_bucket{{{self.labels(labels, le='+Inf')}}} {histogram.total}")
+                lines.append(f"workload_{name}_sum{{{self.labels(labels)}}} {histogram.sum}")
+                lines.append(f"workload_{name}_count{{{self.labels(labels)}}} {histogram.total}")
+        for kind, values in [("counter", self.counters), ("gauge", self.gauges)]:
+            for name in sorted({name for name, labels in values}):
+                lines.append(f"# TYPE workload_{name} {kind}")
+                for (metric, labels), value in values.items():
+                    if metric == name:
+                        lines.append(f"workload_{name}{{{self.labels(labels)}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def json(self):
+        return json.dumps({
+            "thread": self.thread,
+            "timestamp": time.time(),
+            "histograms": [{
+                "name": name,
+                "labels": dict(labels),
+                "buckets_us": {histogram.value(index) + 1: count for index, count in sorted(histogram.counts.items())},
+                "percentiles_us": {f"p{percent:g}": histogram.percentile(percent) for percent in [50, 90, 99, 99.9]},
+                "max_us": histogram.max,
+                "sum": histogram.sum,
+                "count": histogram.total,
+            } for (name, labels), histogram in self.histograms.items()],
+            "counters": [{
+                "name": name,
+                "labels": dict(labels),
+                "value": value,
+            } for (name, labels), value in self.counters.items()],
+            "gauges": [{
+                "name": name,
+                "labels": dict(labels),
+                "value": value,
+            } for (name, labels), value in self.gauges.items()],
+        }, indent=2)
+
+    # the snapshot replaces the previous one in a single rename, so readers never see a partial file
+    def write(self):
+        self.written = time.monotonic()
+        if not self.enabled:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        ext = "json" if self.format == "json" else "prom"
+        filepath = os.path.join(self.folder, f"metrics-{self.thread}.{ext}")
+        with open(f"{filepath}.tmp", "w") as file:
+            file.write(self.json() if self.format == "json" else self.prometheus())
+        os.replace(f"{filepath}.tmp", filepath)
+
+
+# the column types of the generated files for the columnar parse mode, matching transaction.sql
+COLUMN_TYPES = {} if pa is None else {
+    "ssn": pa.string(),
+    "cc_num": pa.int64(),
+    "first": pa.string(),
+    "last": pa.string(),
+    "gender": pa.string(),
+    "street": pa.string(),
+    "city": pa.string(),
+    "state": pa.string(),
+    "zip": pa.int32(),
+    "lat": pa.float64(),
+    "long": pa.float64(),
+    "city_pop": pa.int32(),
+    "job": pa.string(),
+    "dob": pa.date32(),
+    "acct_num": pa.int64(),
+    "profile": pa.string(),
+    "trans_num": pa.string(),
+    "trans_date": pa.date32(),
+    "trans_time": pa.time32("s"),
+    "unix_time": pa.int64(),
+    "category": pa.string(),
+    "amt": pa.float64(),
+    "is_fraud": pa.bool_(),
+    "merchant": pa.string(),
+    "merch_lat": pa.float64(),
+    "merch_long": pa.float64(),
+}
+
+# converts the values of a parsed line to the types of their columns in transaction.sql, so they
+# can be bound in binary, the strings and the merchant uuid are bound as they are
+FIELD_TYPES = {
+    Field.cc_num: int,
+    Field.zip: int,
+    Field.lat: float,
+    Field.lng: float,
+    Field.city_pop: int,
+    Field.dob: datetime.date.fromisoformat,
+    Field.acct_num: int,
+    Field.trans_date: datetime.date.fromisoformat,
+    Field.trans_time: datetime.time.fromisoformat,
+    Field.unix_time: int,
+    Field.amt: float,
+    Field.is_fraud: lambda value: value == "1",
+    Field.merch_lat: float,
+    Field.merch_lng: float,
+}
+FIELD_CONVERTERS = [(field.value, convert) for field, convert in FIELD_TYPES.items()]
+
+# rows per file of a saved dataset, and rows replayed from it at a time
+DATASET_CHUNK = 50000
+REPLAY_CHUNK = 5000
+
+# rows handed from the producer thread to transact() at a time when prefetching, as a RecordBlock
+PREFETCH_CHUNK = 1000
+
+# bytes of a generated file parsed at a time by a process of the parallel parse pool
+PARSE_CHUNK = 4 << 20
+
+# statements per frame of a capture log, and the bytes every capture log starts with
+CAPTURE_FRAME = 1000
+CAPTURE_MAGIC = b"TXCAPTURE1\n"
+
+# the reference data below stands in for the Sparkov profiles and faker providers
+# so the numpy generator can produce the same shaped rows as datagen.py
+PROFILES = [
+    # (profile file, gender, min age, max age, urban)
+    ("adults_2550_female_rural.json", "F", 25, 50, False),
+    ("adults_2550_female_urban.json", "F", 25, 50, True),
+    ("adults_2550_male_rural.json", "M", 25, 50, False),
+    ("adults_2550_male_urban.json", "M", 25, 50, True),
+    ("adults_50up_female_rural.json", "F", 50, 90, False),
+    ("adults_50up_female_urban.json", "F", 50, 90, True),
+    ("adults_50up_male_rural.json", "M", 50, 90, False),
+    ("adults_50up_male_urban.json", "M", 50, 90, True),
+    ("young_adults_female_rural.json", "F", 18, 25, False),
+    ("young_adults_female_urban.json", "F", 18, 25, True),
+    ("young_adults_male_rural.json", "M", 18, 25, False),
+    ("young_adults_male_urban.json", "M", 18, 25, True),
+]
+
+CATEGORIES = [
+    # (category, weight, log mean amount, log sigma amount)
+    ("gas_transport", 0.10, 4.1, 0.3),
+    ("grocery_pos", 0.10, 4.6, 0.4),
+    ("home", 0.09, 3.8, 0.9),
+    ("shopping_pos", 0.09, 3.9, 1.1),
+    ("kids_pets", 0.09, 3.7, 0.9),
+    ("shopping_net", 0.08, 3.9, 1.2),
+    ("entertainment", 0.07, 3.7, 0.9),
+    ("food_dining", 0.07, 3.6, 0.8),
+    ("personal_care", 0.07, 3.4, 1.0),
+    ("health_fitness", 0.07, 3.6, 0.8),
+    ("misc_pos", 0.06, 3.3, 1.2),
+    ("misc_net", 0.05, 3.5, 1.3),
+    ("grocery_net", 0.04, 4.0, 0.5),
+    ("travel", 0.02, 3.5, 1.6),
+]
+
+CITIES = [
+    # (city, state, zip, lat, lng, city_pop)
+    ("New York", "NY", 10001, 40.7506, -73.9971, 1577385),
+    ("Los Angeles", "CA", 90012, 34.0614, -118.2385, 2383912),
+    ("Chicago", "IL", 60601, 41.8858, -87.6181, 2680484),
+    ("Houston", "TX", 77002, 29.7594, -95.3594, 2906825),
+    ("Phoenix", "AZ", 85004, 33.4515, -112.0685, 1312244),
+    ("Philadelphia", "PA", 19103, 39.9522, -75.1741, 1526206),
+    ("San Antonio", "TX", 78205, 29.4237, -98.4925, 1364335),
+    ("San Diego", "CA", 92101, 32.7194, -117.1628, 1241364),
+    ("Dallas", "TX", 75201, 32.7904, -96.8044, 1263321),
+    ("Seattle", "WA", 98101, 47.6114, -122.3305, 744955),
+    ("Denver", "CO", 80202, 39.7528, -104.9997, 716492),
+    ("Boston", "MA", 2108, 42.3576, -71.0678, 675647),
+    ("Atlanta", "GA", 30303, 33.7525, -84.3888, 498715),
+    ("Miami", "FL", 33130, 25.7674, -80.2044, 442241),
+    ("Minneapolis", "MN", 55401, 44.9847, -93.2700, 429954),
+    ("Burlington", "VT", 5401, 44.4759, -73.2121, 44743),
+    ("Bozeman", "MT", 59715, 45.6793, -111.0440, 53293),
+    ("Ames", "IA", 50010, 42.0377, -93.6111, 66427),
+    ("Hershey", "PA", 17033, 40.2732, -76.6527, 14257),
+    ("Moab", "UT", 84532, 38.5733, -109.5498, 5366),
+    ("Bar Harbor", "ME", 4609, 44.3876, -68.2039, 5089),
+    ("Fairbanks", "AK", 99701, 64.8378, -147.7164, 32515),
+    ("Hilo", "HI", 96720, 19.7071, -155.0816, 45703),
+    ("Taos", "NM", 87571, 36.4072, -105.5731, 6474),
+    ("Dodge City", "KS", 67801, 37.7528, -100.0171, 27788),
+    ("Elko", "NV", 89801, 40.8324, -115.7631, 20564),
+    ("Laramie", "WY", 82070, 41.3114, -105.5911, 31407),
+    ("Beaufort", "SC", 29902, 32.4316, -80.6698, 13607),
+    ("Marquette", "MI", 49855, 46.5436, -87.3954, 20629),
+    ("Sedona", "AZ", 86336, 34.8697, -111.7610, 9684),
+]
+
+FIRST_NAMES = {
+    "F": ["Mary", "Jennifer", "Linda", "Patricia", "Elizabeth", "Susan", "Jessica",
+          "Sarah", "Karen", "Nancy", "Lisa", "Betty", "Sandra", "Ashley", "Kimberly",
+          "Emily", "Donna", "Michelle", "Amanda", "Melissa", "Stephanie", "Rebecca"],
+    "M": ["James", "John", "Robert", "Michael", "William", "David", "Richard",
+          "Joseph", "Thomas", "Charles", "Christopher", "Daniel", "Matthew", "Anthony",
+          "Mark", "Donald", "Steven", "Paul", "Andrew", "Joshua", "Kenneth", "Kevin"],
+}
+
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis",
+    "Rodriguez", "Martinez", "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson",
+    "Thomas", "Taylor", "Moore", "Jackson", "Martin", "Lee", "Perez", "Thompson",
+    "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson", "Walker",
+    "Young", "Allen", "King", "Wright", "Scott", "Torres", "Nguyen", "Hill", "Flores",
+]
+
+STREET_NAMES = [
+    "Oak", "Maple", "Cedar", "Pine", "Elm", "Washington", "Lake", "Hill", "Park",
+    "Main", "Church", "Walnut", "Sunset", "Ridge", "Meadow", "River", "Forest",
+]
+
+STREET_SUFFIXES = ["St", "Ave", "Rd", "Blvd", "Ln", "Dr", "Ct", "Way"]
+
+JOBS = [
+    "Accountant", "Architect", "Barrister", "Chemical engineer", "Civil engineer",
+    "Data scientist", "Dentist", "Designer, interior", "Electrician", "Film editor",
+    "Firefighter", "Geologist", "Graphic designer", "Journalist", "Librarian",
+    "Mechanical engineer", "Nurse, adult", "Paramedic", "Pharmacist", "Pilot, airline",
+    "Police officer", "Psychologist", "Radiographer", "Retail manager", "Surveyor",
+    "Systems developer", "Teacher, primary school", "Veterinary surgeon", "Web designer",
+]
+
+MERCHANT_SUFFIXES = ["LLC", "Inc", "Group", "Ltd", "PLC", "and Sons"]
+
+MERCHANTS_PER_CATEGORY = 50
+
+
 class Transactionwin:
 
     def __init__(self, args: dict):
@@ -48,13 +584,131 @@ class Transactionwin:
         self.days: int = int(args.get("days", 10))
         self.batch_size: int = int(args.get("batch_size", 128))
         self.update_freq: int = int(args.get("update_freq", 10))
+        # the percent of batches upserted with DO UPDATE can be set for each table, update_freq otherwise
+        self.update_freqs = {table: int(args.get(f"{table}_update_freq", self.update_freq))
+            for table in ["address", "city_loc", "customer", "merchant"]}
+        # with a latency slo in milliseconds each table adapts its batch size between batch_min and batch_max
+        self.batch_slo: float = float(args.get("batch_slo", 0))
+        self.batch_min: int = int(args.get("batch_min", 16))
+        self.batch_max: int = int(args.get("batch_max", 4096))
+        # serialization failures are retried with jittered exponential backoff between retry_base
+        # and retry_cap milliseconds, and after split_after attempts the batch is split in halves
+        self.retry_max: int = int(args.get("retry_max", 5))
+        self.retry_base: float = float(args.get("retry_base", 10))
+        self.retry_cap: float = float(args.get("retry_cap", 1000))
+        self.split_after: int = int(args.get("split_after", 2))
+        # insert sends the transaction rows as multi-row inserts, copy streams them with COPY FROM STDIN
+        self.load_mode: string = str(args.get("load_mode", "insert"))
+        self.copy_size: int = int(args.get("copy_size", 10000))
+        # rows splits each line into strings, columnar reads typed columns with pyarrow,
+        # parallel splits the files in chunks that are parsed by a pool of processes
+        self.parse_mode: string = str(args.get("parse_mode", "rows"))
+        # fraction of the host's cpus the parse pools of all the threads use together
+        self.parse_cpus: float = float(args.get("parse_cpus", 1.0))
+        # text sends every value as a string the server casts to the column type, binary converts
+        # the values to their column types while parsing and binds them with %b placeholders
+        self.param_format: string = str(args.get("param_format", "text"))
+        # batches of the transaction table per explicit transaction, the dimension rows they need
+        # commit with them, 0 keeps autocommit and every statement commits on its own
+        self.commit_batches: int = int(args.get("commit_batches", 0))
+        # values sends a placeholder per value, unnest binds an array per column so the sql is constant
+        self.statement_mode: string = str(args.get("statement_mode", "values"))
+        # statements prepared on the server for each table, row count and conflict clause, with the
+        # adaptive sizes of full multi-row inserts rounded down to a power of two so few shapes are used, 0 disables it
+        self.statement_cache: int = int(args.get("statement_cache", 0))
+        # server leaves the transaction id to gen_random_uuid(), client generates it and batches the rows
+        # of each of the 16 ranges transaction.sql splits the table into on their own
+        self.key_mode: string = str(args.get("key_mode", "server"))
+        # with client keys, all spreads the ids over every range, owned only uses the ranges
+        # whose leading hex digit modulo the thread count is the thread's id
+        self.ranges: string = str(args.get("ranges", "all"))
+        # transaction rows per second across all the threads, the batches are sent on a schedule
+        # and their latency measured from when they were due, 0 sends them as fast as possible
+        self.rate: float = float(args.get("rate", 0))
+        # shared lets every thread upsert the same customers, zips and merchants, partitioned gives each
+        # thread its own accounts, cards and ssns and a single owning thread for every zip and merchant
+        self.key_space: string = str(args.get("key_space", "shared"))
+        # serial waits for each batch, pipeline sends one batch per table together
+        self.flush_mode: string = str(args.get("flush_mode", "serial"))
+        # keys per dimension table remembered to skip unchanged rows, 0 disables the cache
+        self.cache_size: int = int(args.get("cache_size", 0))
         self.generator_location: string = str(args.get("generator_location",
             f"{os.environ['USERPROFILE']}/workspace/example-ml-flow/Sparkov_Data_Generation"))
         self.data_folder: string = str(args.get("data_folder",
             f"{os.environ['USERPROFILE']}/workspace/example-ml-flow/data/generated"))
+        # sparkov runs datagen.py in a subprocess, numpy generates the rows in-process
+        self.generator: string = str(args.get("generator", "sparkov"))
+        self.chunk_size: int = int(args.get("chunk_size", 1000))
+        # like datagen.py the customers are seeded, so the same customers come back every window
+        self.seed: int = int(args.get("seed", 42))
+        # seed of the transactions the numpy generator samples and of the DO UPDATE coin flips,
+        # so a run can be repeated, empty draws new ones every run
+        self.run_seed: string = str(args.get("run_seed", ""))
+        # uniform, zipf or hotspot popularity of the customers, cities and merchants the numpy
+        # generator picks. zipf ranks the keys with exponent zipf_s, hotspot sends hot_share of
+        # the picks to hot_fraction of the keys, and the same keys are hot in every window
+        self.skew: string = str(args.get("skew", "uniform"))
+        self.zipf_s: float = float(args.get("zipf_s", 1.1))
+        self.hot_fraction: float = float(args.get("hot_fraction", 0.01))
+        self.hot_share: float = float(args.get("hot_share", 0.9))
+        # rows generated and parsed ahead by a background thread, 0 generates each window in loop()
+        self.prefetch: int = int(args.get("prefetch", 0))
+        # name of a window saved under data_folder/datasets and replayed with shifted dates,
+        # the first run generates and saves it, an empty name generates every window
+        self.dataset: string = str(args.get("dataset", ""))
+        # each thread appends the statements it sends to capture-<thread id>.log in this folder,
+        # so replay.py can send them again without generating the data
+        self.capture_folder: string = str(args.get("capture_folder", ""))
+        # each thread writes a snapshot of its metrics to this folder, metrics are off without it
+        self.metrics = Metrics(
+            str(args.get("metrics_folder", "")),
+            str(args.get("metrics_format", "prometheus")),
+            float(args.get("metrics_interval", 10)))
 
         # you can arbitrarely add any variables you want
         self.counter: int = 0
+        self.pending = {}
+        self.merchant_uuids = {}
+        self.caches = {table: DimensionCache(self.cache_size)
+            for table in ["address", "city_loc", "customer", "merchant"]}
+        self.batch_sizes = {table: self.batch_size
+            for table in ["address", "city_loc", "customer", "merchant"]}
+        self.batch_sizes["transaction"] = self.copy_size if self.load_mode == "copy" else self.batch_size
+        self.controllers = {} if self.batch_slo <= 0 else {
+            table: BatchController(size, self.batch_min, max(self.batch_max, size), self.batch_slo / 1000)
+            for table, size in self.batch_sizes.items()}
+        self.pipelining = False
+        self.pipeline_error = None
+        self.retries = Counter()
+        self.group = []
+        self.total_thread_count = 1
+        self.owned_ranges = list(range(16))
+        self.range_batches = 0
+        self.owners = {}
+        self.schedule_start = None
+        self.scheduled_rows = 0
+        self.scheduled_sent = 0
+        self.scheduled_batch = None
+        self.scheduled_latency = LatencyHistogram()
+        self.service_latency = LatencyHistogram()
+        self.range_count = 0
+        self.statements = OrderedDict()
+        self.statements_conn = None
+        self.statement_hits = 0
+        self.statement_misses = 0
+        self.statement_evictions = 0
+        self.commits = 0
+        self.commit_rows = 0
+        self.commit_seconds = 0.0
+        self.records = []
+        self.producer = None
+        self.parse_pool = None
+        self.capture = None
+        self.captured = []
+        self.consumed = True
+        self.dataset_chunks = None
+        self.reseed(0)
+        self.init_merchants()
 
 
 
@@ -63,6 +717,16 @@ class Transactionwin:
     # Also, the function is a vector to receive the excuting threads's unique id and the total thread count
     def setup(self, conn: psycopg.Connection, id: int, total_thread_count: int):
         self.id = id
+        self.total_thread_count = total_thread_count
+        self.metrics.thread = id
+        self.reseed(id)
+        if self.capture_folder:
+            self.capture = CaptureLog(os.path.join(self.capture_folder, f"capture-{id}.log"))
+            atexit.register(self.capture.close)
+        if self.rate > 0:
+            atexit.register(self.report_schedule)
+        if self.ranges == "owned":
+            self.owned_ranges = [r for r in range(16) if r % total_thread_count == id % min(total_thread_count, 16)]
         with conn.cursor() as cur:
             print(
                 f"My thread ID is {id}. The total count of threads is {total_thread_count}"
@@ -76,14 +740,49 @@ class Transactionwin:
     # Once every func has been executed, run() is re-evaluated.
     # This process continues until dbworkload exits.
     def loop(self):
-        try:
-            shutil.rmtree(f"{self.data_folder}\\{self.id}")
-        except FileNotFoundError:
-            print("ignoring FileNotFoundError during rmtree command")
-        
-        start_days_ahead = (self.days * self.counter) + 1
+        with self.metrics.timer("phase_seconds", phase="loop"):
+            return self.generate_window()
+
+
+
+    def generate_window(self):
+        # a window that failed in transact() leaves its records open on a file of the folder
+        # that's removed next, and windows can't remove a folder with an open file
+        close = getattr(self.records, "close", None)
+        if close:
+            close()
+        self.records = []
+
+        if self.dataset:
+            self.load_dataset()
+        if self.prefetch > 0:
+            self.start_producer()
+            return [self.parse, self.transact]
+
+        start_date, end_date = self.window(self.counter)
+        if self.generator == "numpy" or self.dataset:
+            self.start_date, self.end_date = start_date, end_date
+            return [self.parse, self.transact]
+
+        self.run_datagen(f"{self.data_folder}/{self.id}", start_date, end_date)
+
+        self.records = []
+        # print(f"id: {self.id} and counter: {self.counter} LOOP completed")
+        return [self.parse, self.transact]
+
+
+
+    # each window starts the day after the previous one ends
+    def window(self, counter):
+        start_days_ahead = (self.days * counter) + 1
         start_date=datetime.datetime.now() + timedelta(days=start_days_ahead)
         end_date=start_date + timedelta(days=self.days)
+        return start_date, end_date
+
+
+
+    def run_datagen(self, folder, start_date, end_date):
+        self.remove_folder(folder)
 
         command = [
             "python3",
@@ -91,7 +790,7 @@ class Transactionwin:
             "-n",
             str(self.customers),
             "-o",
-            f"{self.data_folder}/{self.id}",
+            folder,
             start_date.strftime("%m-%d-%Y"),
             end_date.strftime("%m-%d-%Y")
         ]
@@ -99,9 +798,82 @@ class Transactionwin:
         subprocess.run(command, cwd=self.generator_location,
             stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
 
-        self.records = []
-        # print(f"id: {self.id} and counter: {self.counter} LOOP completed")
-        return [self.parse, self.transact]
+
+
+    def remove_folder(self, folder):
+        try:
+            shutil.rmtree(folder)
+        except FileNotFoundError:
+            print("ignoring FileNotFoundError during rmtree command")
+
+
+
+    # with prefetch a background thread generates and parses the next windows while transact()
+    # writes the current one, handing the rows over in chunks through a bounded queue.
+    # the producer owns the worker's data folder and gives each window its own sub folder,
+    # which it removes once the window has been parsed
+    def start_producer(self):
+        if self.producer is not None:
+            return
+        self.chunks = queue.Queue(maxsize=max(1, self.prefetch // PREFETCH_CHUNK))
+        self.remove_folder(f"{self.data_folder}/{self.id}")
+        self.producer = threading.Thread(target=self.produce, args=(self.counter,),
+            name=f"producer-{self.id}", daemon=True)
+        self.producer.start()
+
+
+
+    def produce(self, counter):
+        try:
+            while True:
+                start_date, end_date = self.window(counter)
+                folder = f"{self.data_folder}/{self.id}/{counter}"
+                if self.dataset:
+                    records = self.typed_records(self.replay(start_date))
+                elif self.generator == "numpy":
+                    records = self.typed_records(self.generate(start_date, end_date))
+                else:
+                    self.run_datagen(folder, start_date, end_date)
+                    records = self.read_files(folder)
+
+                chunk = []
+                for record in records:
+                    chunk.append(record)
+                    if len(chunk) >= PREFETCH_CHUNK:
+                        self.chunks.put(RecordBlock(chunk))
+                        chunk = []
+                self.chunks.put(RecordBlock(chunk))
+                # marks the end of the window
+                self.chunks.put(None)
+
+                if self.generator != "numpy" and not self.dataset:
+                    self.remove_folder(folder)
+                counter += 1
+        except BaseException as e:
+            self.chunks.put(e)
+
+
+
+    # streams the rows of the next window from the producer, if the previous window
+    # wasn't read to the end its remaining rows are skipped first so the windows stay aligned
+    def consume(self):
+        skipping = not self.consumed
+        self.consumed = False
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                if skipping:
+                    skipping = False
+                    continue
+                self.consumed = True
+                return
+            if isinstance(chunk, BaseException):
+                # the producer has stopped, so the next loop() starts a new one
+                self.producer = None
+                self.consumed = True
+                raise chunk
+            if not skipping:
+                yield from chunk
 
 
 
@@ -111,7 +883,51 @@ class Transactionwin:
         self.counter += 1
         # print(f"id: {self.id} and counter: {self.counter} PARSE called")
 
-        directory = f"{self.data_folder}/{self.id}"
+        if self.prefetch > 0:
+            self.records = self.consume()
+        elif self.dataset:
+            self.records = self.typed_records(self.replay(self.start_date))
+        elif self.generator == "numpy":
+            self.records = self.typed_records(self.generate(self.start_date, self.end_date))
+        else:
+            self.records = self.read_files(f"{self.data_folder}/{self.id}")
+
+        if self.metrics.enabled:
+            self.records = self.metrics.timed(self.records, "phase_seconds", phase="parse")
+
+
+
+    # columnar and parallel parsing already give the values the types of their columns
+    def read_files(self, directory):
+        if self.parse_mode == "columnar":
+            return self.read_columns(directory)
+        if self.parse_mode == "parallel":
+            return self.read_parallel(directory)
+        return self.typed_records(self.read(directory))
+
+
+
+    def typed_records(self, records):
+        if self.param_format == "binary":
+            return map(self.typed, records)
+        return records
+
+
+
+    # converts the values of a record to the types of their columns, once for every row parsed
+    @staticmethod
+    def typed(record):
+        if type(record) is not list:
+            record = list(record)
+        for index, convert in FIELD_CONVERTERS:
+            record[index] = convert(record[index])
+        return record
+
+
+
+    # streams the rows from the generated files one at a time, so transact() can
+    # start writing right away and only holds the batches that are in flight
+    def read(self, directory):
         for filename in os.listdir(directory):
             filepath = os.path.join(directory, filename)
             base = os.path.basename(filepath)
@@ -122,21 +938,584 @@ class Transactionwin:
                     for line in file:
                         record = line.strip().split('|')
                         record.append(uuid.uuid5(uuid.NAMESPACE_DNS, record[Field.merchant.value]))
-                        self.records.append(record)
+                        yield record
+
+
+
+    # streams the generated files as blocks of typed columns, the merchant uuid is computed once
+    # per distinct merchant name and the rows are zipped back together for the batches in transact()
+    def read_columns(self, directory):
+        if pa is None:
+            raise ImportError("pyarrow is required for parse_mode columnar")
+
+        for filename in os.listdir(directory):
+            filepath = os.path.join(directory, filename)
+            base = os.path.basename(filepath)
+            ext = os.path.splitext(filepath)[-1]
+            if not base.startswith('customers') and ext == '.csv':
+                reader = csv.open_csv(filepath,
+                    read_options=csv.ReadOptions(block_size=1 << 20),
+                    parse_options=csv.ParseOptions(delimiter='|'),
+                    convert_options=csv.ConvertOptions(column_types=COLUMN_TYPES))
+                for batch in reader:
+                    merchants = pc.dictionary_encode(batch.column(Field.merchant.value))
+                    merch_ids = np.array([self.merchant_uuid(name)
+                        for name in merchants.dictionary.to_pylist()], dtype=object)
+                    columns = [self.column_values(column) for column in batch.columns]
+                    columns.append(merch_ids[merchants.indices.to_numpy()].tolist())
+                    yield from zip(*columns)
+
+
+
+    # splits the generated files in chunks of about PARSE_CHUNK bytes that a pool of processes
+    # parses, a few chunks ahead of transact(), and streams the rows back in file order
+    def read_parallel(self, directory):
+        if self.parse_pool is None:
+            # the threads on the host share parse_cpus of its cpus
+            self.parse_workers = max(1, int(os.cpu_count() * self.parse_cpus / self.total_thread_count))
+            self.parse_pool = ProcessPoolExecutor(self.parse_workers)
+            atexit.register(self.parse_pool.shutdown, cancel_futures=True)
+
+        pending = deque()
+        for filename in os.listdir(directory):
+            filepath = os.path.join(directory, filename)
+            base = os.path.basename(filepath)
+            ext = os.path.splitext(filepath)[-1]
+            if not base.startswith('customers') and ext == '.csv':
+                size = os.path.getsize(filepath)
+                for start in range(0, size, PARSE_CHUNK):
+                    pending.append(self.parse_pool.submit(
+                        self.read_chunk, filepath, start, min(start + PARSE_CHUNK, size),
+                        self.param_format == "binary"))
+                    while len(pending) > 2 * self.parse_workers:
+                        yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+
+    # parses the lines that start between the start and end offsets of a file in a pool process.
+    # the rows go back as a RecordBlock, so the values they repeat are pickled once
+    # and the merchant uuid is computed once per merchant in the chunk.
+    # with typed the values are converted to their column types in the pool process as well
+    @staticmethod
+    def read_chunk(filepath, start, end, typed=False):
+        records = []
+        merchant_uuids = {}
+        with open(filepath, 'rb') as file:
+            if start == 0:
+                position = len(file.readline()) # skip the first line (header)
+            else:
+                # finishes the line that started before the chunk, unless start is a line start
+                file.seek(start - 1)
+                position = start - 1 + len(file.readline())
+            while position < end:
+                line = file.readline()
+                if not line:
+                    break
+                position += len(line)
+                record = line.decode().strip().split('|')
+                merchant = record[Field.merchant.value]
+                id = merchant_uuids.get(merchant)
+                if id is None:
+                    id = merchant_uuids[merchant] = uuid.uuid5(uuid.NAMESPACE_DNS, merchant)
+                record.append(id)
+                records.append(Transactionwin.typed(record) if typed else record)
+        return RecordBlock(records)
+
+
+
+    # converting dates and times to python objects is slow,
+    # so they're converted once per distinct value and then looked up
+    def column_values(self, column):
+        if pa.types.is_temporal(column.type):
+            encoded = pc.dictionary_encode(column)
+            values = np.array(encoded.dictionary.to_pylist(), dtype=object)
+            return values[encoded.indices.to_numpy()].tolist()
+        return column.to_pylist()
+
+
+
+    def merchant_uuid(self, name):
+        id = self.merchant_uuids.get(name)
+        if id is None:
+            id = self.merchant_uuids[name] = uuid.uuid5(uuid.NAMESPACE_DNS, name)
+        return id
+
+
+
+    # a dataset is a generated window saved as numpy arrays, DATASET_CHUNK rows per folder and one
+    # file per column. columns with few distinct values keep the values once plus an int32 code per row,
+    # trans_num is kept as 16 bytes and merch_id is derived from the merchant again when replayed
+    def load_dataset(self):
+        if self.dataset_chunks is not None:
+            return
+
+        folder = os.path.join(self.data_folder, "datasets", self.dataset)
+        if not os.path.exists(os.path.join(folder, "dataset.json")):
+            self.save_dataset(folder)
+
+        with open(os.path.join(folder, "dataset.json")) as file:
+            saved = json.load(file)
+        # a dataset saved with other settings would replay a different window under these ones
+        settings = {"customers": self.customers, "days": self.days, "generator": self.generator}
+        changed = {key: saved.get(key) for key, value in settings.items() if saved.get(key) != value}
+        if changed:
+            raise ValueError(f"dataset {self.dataset} was saved with " + ", ".join(
+                f"{key} {value}" for key, value in changed.items()) + ", remove it or use another dataset name")
+        self.dataset_start = np.datetime64(saved["start"], "D")
+        self.dataset_chunks = []
+        for chunk in sorted(os.listdir(folder)):
+            if chunk == "dataset.json":
+                continue
+            columns = {}
+            for filename in os.listdir(os.path.join(folder, chunk)):
+                columns[filename[:-len(".npy")]] = np.load(os.path.join(folder, chunk, filename), mmap_mode="r")
+            merchants = columns.get("merchant.values")
+            if merchants is not None:
+                columns["merch_id.values"] = np.array(
+                    [self.merchant_uuid(name) for name in merchants.tolist()], dtype=object)
+            self.dataset_chunks.append(columns)
+
+
+
+    # generates a window with the configured generator and saves it, other workers may be saving
+    # the same dataset so it's written to a temporary folder and renamed, the first rename wins
+    def save_dataset(self, folder):
+        start_date, end_date = self.window(self.counter)
+        if self.generator == "numpy":
+            records = self.generate(start_date, end_date)
+        else:
+            self.run_datagen(f"{self.data_folder}/{self.id}", start_date, end_date)
+            records = self.read(f"{self.data_folder}/{self.id}")
+
+        saving = f"{folder}.{os.getpid()}.{self.id}"
+        self.remove_folder(saving)
+        os.makedirs(saving)
+        chunks = 0
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= DATASET_CHUNK:
+                self.save_chunk(os.path.join(saving, f"{chunks:06d}"), chunk)
+                chunks += 1
+                chunk = []
+        if chunk:
+            self.save_chunk(os.path.join(saving, f"{chunks:06d}"), chunk)
+        with open(os.path.join(saving, "dataset.json"), "w") as file:
+            json.dump({"start": start_date.date().isoformat(), "days": self.days,
+                "customers": self.customers, "generator": self.generator}, file)
+
+        try:
+            os.rename(saving, folder)
+        except OSError:
+            self.remove_folder(saving)
+        if self.generator != "numpy":
+            self.remove_folder(f"{self.data_folder}/{self.id}")
+
+
+
+    def save_chunk(self, folder, chunk):
+        os.makedirs(folder)
+        for field, column in zip(Field, zip(*chunk)):
+            if field is Field.merch_id:
+                continue
+            path = os.path.join(folder, field.name)
+            if field is Field.trans_num:
+                np.save(path, np.frombuffer(bytes.fromhex("".join(column)), dtype=np.uint64).reshape(-1, 2))
+            elif field is Field.unix_time:
+                np.save(path, np.array(column, dtype=np.int64))
+            else:
+                values, codes = np.unique(np.array(column, dtype=str), return_inverse=True)
+                if field is Field.merchant or len(values) * 2 <= len(column):
+                    np.save(path + ".values", values)
+                    np.save(path, codes.astype(np.int32))
+                else:
+                    np.save(path, values[codes])
+
+
+
+    # replays the saved dataset for the window starting at start_date, the dates move forward
+    # by the whole days between the saved window and this one so the times of day stay the same,
+    # and every replay xors trans_num with its own random mask so the keys don't repeat
+    def replay(self, start_date):
+        days = np.datetime64(start_date.date(), "D") - self.dataset_start
+        seconds = days.astype(np.int64) * 86400
+        mask = np.frombuffer(self.rng.bytes(16), dtype=np.uint64)
+
+        for columns in self.dataset_chunks:
+            trans_dates = columns.get("trans_date.values")
+            if trans_dates is not None:
+                trans_dates = (trans_dates.astype("datetime64[D]") + days).astype(str)
+
+            rows = len(columns["unix_time"])
+            for lo in range(0, rows, REPLAY_CHUNK):
+                hi = min(lo + REPLAY_CHUNK, rows)
+                values = []
+                for field in Field:
+                    if field is Field.trans_num:
+                        nums = columns["trans_num"][lo:hi] ^ mask
+                        values.append(np.frombuffer(nums.tobytes().hex().encode(), dtype="S32").astype(str).tolist())
+                    elif field is Field.unix_time:
+                        values.append((columns["unix_time"][lo:hi] + seconds).astype(str).tolist())
+                    elif field is Field.merch_id:
+                        values.append(columns["merch_id.values"][columns["merchant"][lo:hi]].tolist())
+                    elif field is Field.trans_date and trans_dates is not None:
+                        values.append(trans_dates[columns["trans_date"][lo:hi]].tolist())
+                    elif field is Field.trans_date:
+                        values.append((columns["trans_date"][lo:hi].astype("datetime64[D]") + days).astype(str).tolist())
+                    elif field.name + ".values" in columns:
+                        values.append(columns[field.name + ".values"][columns[field.name][lo:hi]].tolist())
+                    else:
+                        values.append(columns[field.name][lo:hi].tolist())
+                yield from zip(*values)
+
+
+
+    # the merchant pool is seeded so every worker shares the same merchants,
+    # just like the merchants.csv file bundled with Sparkov
+    def init_merchants(self):
+        rng = np.random.default_rng(0)
+        names = []
+        for category in CATEGORIES:
+            for i in range(MERCHANTS_PER_CATEGORY):
+                first, second = rng.choice(LAST_NAMES, 2, replace=False)
+                suffix = rng.choice(MERCHANT_SUFFIXES)
+                names.append(f"fraud_{first}-{second} {suffix}")
+        self.merchant_names = np.array(names)
+        self.merchant_ids = np.array(
+            [uuid.uuid5(uuid.NAMESPACE_DNS, name) for name in names], dtype=object)
+
+
+
+    # with a run_seed every thread draws its own repeatable transactions and coin flips
+    def reseed(self, id):
+        run_seed = [int(self.run_seed), id] if self.run_seed else None
+        self.rng = np.random.default_rng(run_seed)
+        self.random = random.Random(repr(run_seed) if run_seed else None)
+
+
+
+    # how popular each of n keys is relative to the average key, ranked in an order seeded
+    # by seed and salt so the same keys are popular in every window and every thread
+    def popularity(self, n, salt):
+        if self.skew == "zipf":
+            weights = 1 / np.arange(1, n + 1) ** self.zipf_s
+        elif self.skew == "hotspot" and n > 1:
+            hot = min(n - 1, max(1, round(n * self.hot_fraction)))
+            weights = np.full(n, (1 - self.hot_share) / (n - hot))
+            weights[:hot] = self.hot_share / hot
+        else:
+            return np.ones(n)
+        return np.random.default_rng([self.seed, salt]).permutation(weights * n / weights.sum())
+
+
+
+    # generates the customers with the same columns that datagen.py writes
+    # to the customers.csv file, seeded so they're the same for every window
+    def generate_customers(self):
+        rng = np.random.default_rng(self.seed)
+        cnt = self.customers
+
+        profile = rng.integers(0, len(PROFILES), cnt)
+        gender = [PROFILES[p][1] for p in profile]
+        urban = np.array([PROFILES[p][4] for p in profile])
+        min_age = np.array([PROFILES[p][2] for p in profile])
+        max_age = np.array([PROFILES[p][3] for p in profile])
+
+        # urban profiles live in the larger half of the cities
+        by_pop = np.argsort([c[5] for c in CITIES])
+        half = len(CITIES) // 2
+        city = np.where(urban,
+            by_pop[half + rng.integers(0, len(CITIES) - half, cnt)],
+            by_pop[rng.integers(0, half, cnt)])
+        if self.skew != "uniform":
+            city = rng.choice(len(CITIES), cnt, p=self.popularity(len(CITIES), 1) / len(CITIES))
+        lat = np.array([CITIES[c][3] for c in city]) + rng.uniform(-0.1, 0.1, cnt)
+        lng = np.array([CITIES[c][4] for c in city]) + rng.uniform(-0.1, 0.1, cnt)
+
+        age_days = rng.uniform(min_age, max_age) * 365.25
+        dob = (np.datetime64(datetime.date.today()) - age_days.astype("timedelta64[D]")).astype(str).tolist()
+
+        ssn = rng.integers([1, 1, 1], [900, 100, 10000], (cnt, 3))
+        cc_num = rng.integers(4_000_000_000_000_000, 5_000_000_000_000_000, cnt)
+        acct_num = rng.integers(100_000_000_000, 1_000_000_000_000, cnt)
+        first = rng.integers(0, len(FIRST_NAMES["F"]), cnt)
+        last = rng.integers(0, len(LAST_NAMES), cnt)
+        house = rng.integers(1, 10000, cnt)
+        street = rng.integers(0, len(STREET_NAMES), cnt)
+        suffix = rng.integers(0, len(STREET_SUFFIXES), cnt)
+        job = rng.integers(0, len(JOBS), cnt)
+
+        customers = []
+        for i in range(cnt):
+            c = CITIES[city[i]]
+            customers.append([
+                f"{ssn[i, 0]:03d}-{ssn[i, 1]:02d}-{ssn[i, 2]:04d}",
+                str(cc_num[i]),
+                FIRST_NAMES[gender[i]][first[i]],
+                LAST_NAMES[last[i]],
+                gender[i],
+                f"{house[i]} {STREET_NAMES[street[i]]} {STREET_SUFFIXES[suffix[i]]}",
+                c[0],
+                c[1],
+                str(c[2]),
+                f"{lat[i]:.4f}",
+                f"{lng[i]:.4f}",
+                str(c[5]),
+                JOBS[job[i]],
+                dob[i],
+                str(acct_num[i]),
+                PROFILES[profile[i]][0]
+            ])
+        return customers, lat, lng
+
+
+
+    # generates the same 27 column rows that parse() builds from the datagen.py output,
+    # the transactions are sampled with numpy for a chunk of customers at a time
+    # and yielded one row at a time so nothing is written to disk
+    def generate(self, start_date, end_date):
+        rng = self.rng
+        customers, cust_lat, cust_lng = self.generate_customers()
+
+        start = int(start_date.timestamp())
+        end = int(end_date.timestamp())
+        weights = np.array([c[1] for c in CATEGORIES])
+        weights = weights / weights.sum()
+        amt_mean = np.array([c[2] for c in CATEGORIES])
+        amt_sigma = np.array([c[3] for c in CATEGORIES])
+        category_names = np.array([c[0] for c in CATEGORIES])
+        # scales each customer's transactions, 1 for all of them without skew
+        activity = self.popularity(self.customers, 2)
+        merchant_p = self.popularity(MERCHANTS_PER_CATEGORY, 3) / MERCHANTS_PER_CATEGORY
+
+        for lo in range(0, self.customers, self.chunk_size):
+            hi = min(lo + self.chunk_size, self.customers)
+
+            # between one and three transactions per day for each customer
+            counts = rng.poisson(rng.uniform(1.0, 3.0, hi - lo) * self.days * activity[lo:hi])
+            cust = np.repeat(np.arange(lo, hi), counts)
+            total = len(cust)
+            if total == 0:
+                continue
+
+            # customers are already in order, so sort on time within each customer
+            unix_time = rng.integers(start, end, total)
+            unix_time = unix_time[np.lexsort((unix_time, cust))]
+            trans_ts = np.char.partition(unix_time.astype("datetime64[s]").astype(str), "T")
+
+            category = rng.choice(len(CATEGORIES), total, p=weights)
+            amt = rng.lognormal(amt_mean[category], amt_sigma[category])
+            is_fraud = rng.random(total) < 0.005
+            amt[is_fraud] *= rng.uniform(2.0, 5.0, is_fraud.sum())
+
+            if self.skew == "uniform":
+                merch = category * MERCHANTS_PER_CATEGORY + rng.integers(0, MERCHANTS_PER_CATEGORY, total)
+            else:
+                merch = category * MERCHANTS_PER_CATEGORY + rng.choice(MERCHANTS_PER_CATEGORY, total, p=merchant_p)
+            merch_lat = cust_lat[cust] + rng.uniform(-1.0, 1.0, total)
+            merch_lng = cust_lng[cust] + rng.uniform(-1.0, 1.0, total)
+
+            trans_num = np.frombuffer(rng.bytes(16 * total).hex().encode(), dtype="S32").astype(str)
+
+            for c, *record in zip(
+                cust.tolist(),
+                trans_num.tolist(),
+                trans_ts[:, 0].tolist(),
+                trans_ts[:, 2].tolist(),
+                unix_time.astype(str).tolist(),
+                category_names[category].tolist(),
+                np.char.mod("%.2f", amt).tolist(),
+                is_fraud.astype(np.int8).astype(str).tolist(),
+                self.merchant_names[merch].tolist(),
+                np.char.mod("%.6f", merch_lat).tolist(),
+                np.char.mod("%.6f", merch_lng).tolist(),
+                self.merchant_ids[merch].tolist()
+            ):
+                yield customers[c] + record
 
 
 
     def execute(self, conn: psycopg.Connection, data, record_cnt, ins_sql, con_sql):
-        fields = ','.join("%s" for i in range(int(len(data) / record_cnt)))
+        self.retry(conn, ins_sql.split()[2], self.send_values, data, record_cnt, ins_sql, con_sql)
+
+
+
+    def copy(self, conn: psycopg.Connection, data, record_cnt, copy_sql):
+        self.retry(conn, copy_sql.split()[1], self.send_copy, data, record_cnt, copy_sql)
+
+
+
+    # concurrent workers upserting the same keys make cockroachdb abort statements with 40001,
+    # the statement is an implicit transaction so it can be sent again after a jittered backoff,
+    # and once a batch keeps failing its halves are sent on their own so fewer keys contend.
+    # in a pipeline the error only shows up at the sync, where the batches are resent one by one
+    def retry(self, conn: psycopg.Connection, table, send, data, record_cnt, *sql):
+        attempt = 0
+        while True:
+            try:
+                send(conn, data, record_cnt, *sql)
+                return
+            except psycopg.errors.SerializationFailure:
+                # the whole explicit transaction is aborted, so it's retried as a group,
+                # in a pipeline once the error shows up at the sync
+                if self.pipelining:
+                    raise
+                if self.group:
+                    self.retry_group(conn)
+                    return
+                attempt += 1
+                self.adapt(table)
+                if attempt > self.retry_max:
+                    self.count_retry(table, "give_up")
+                    raise
+
+                if attempt >= self.split_after and record_cnt > 1:
+                    self.count_retry(table, "split")
+                    half = record_cnt // 2
+                    fields = len(data) // record_cnt
+                    self.retry(conn, table, send, data[:half * fields], half, *sql)
+                    self.retry(conn, table, send, data[half * fields:], record_cnt - half, *sql)
+                    return
+
+                self.count_retry(table, "retry")
+                backoff = min(self.retry_cap, self.retry_base * 2 ** (attempt - 1))
+                time.sleep(self.random.uniform(0, backoff) / 1000)
+
+
+
+    def count_retry(self, table, outcome):
+        self.retries[(table, outcome)] += 1
+        if self.metrics.enabled:
+            self.metrics.count("retries_total", table=table, outcome=outcome)
+
+
+
+    def send_values(self, conn: psycopg.Connection, data, record_cnt, ins_sql, con_sql):
+        start = time.perf_counter()
+        fields = len(data) // record_cnt
+        if self.statement_cache > 0:
+            statement = self.cached_statement(conn, fields, record_cnt, ins_sql, con_sql)
+        else:
+            statement = self.build_statement(fields, record_cnt, ins_sql, con_sql)
+        if self.statement_mode == "unnest":
+            params = [data[i::fields] for i in range(fields)]
+        else:
+            params = tuple(data)
+        built = time.perf_counter()
+        sent = time.time()
+        table = ins_sql.split()[2]
+        # a statement of an explicit transaction is counted once, when it joins the group
+        if self.join_group(conn, table, statement, params, record_cnt):
+            self.count_sent(table, record_cnt, statement, data, con_sql)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(statement, params, prepare=self.statement_cache > 0 or None)
+        except psycopg.Error as e:
+            # in a pipeline the batches after a failed statement are still queued, so they are
+            # in the group when it's retried, and the error is raised once the pipeline is synced
+            if not self.pipelining:
+                raise
+            self.pipeline_error = self.pipeline_error or e
+            return
+        if self.capture:
+            self.capture_sent(sent, statement, params)
+
+        if self.controllers and not self.pipelining:
+            self.adapt(table, time.perf_counter() - built, record_cnt)
+
+        if self.metrics.enabled:
+            self.metrics.observe("build_seconds", built - start, table=table)
+            self.metrics.observe("statement_seconds", time.perf_counter() - built, table=table)
+        if not self.group:
+            self.count_sent(table, record_cnt, statement, data, con_sql)
+
+
+
+    def count_sent(self, table, record_cnt, statement, data, con_sql):
+        if not self.metrics.enabled:
+            return
+        self.metrics.count_statement(table, record_cnt, statement, data)
+        if con_sql:
+            resolution = "update" if "DO UPDATE" in con_sql else "nothing"
+            self.metrics.count("conflicts_total", table=table, resolution=resolution)
+
+
+
+    # a multi-row insert is a different statement for every batch size, so every early
+    # or trailing flush makes the server parse and plan a new one. binding an array per column
+    # keeps the sql of a table and conflict clause the same whatever the batch size
+    def build_statement(self, fields, record_cnt, ins_sql, con_sql):
+        placeholder = "%b" if self.param_format == "binary" else "%s"
+        if self.statement_mode == "unnest":
+            types = UNNEST_TYPES[ins_sql.split()[2]]
+            # a client side transaction id comes before the other columns
+            if fields > len(types):
+                types = ["UUID"] + types
+            arrays = ', '.join(f"{placeholder}::{type}[]" for type in types)
+            return f"{ins_sql} SELECT * FROM unnest({arrays}) {con_sql};"
+
+        fields = ','.join(placeholder for i in range(fields))
         values = ','.join(f"({fields})" for i in range(record_cnt))
+        return f"{ins_sql} VALUES {values} {con_sql};"
+
+
+
+    # the statements are kept for the connection they were prepared on, keyed on the table,
+    # the row count (any count for unnest) and the conflict clause, the least recently used
+    # statement is evicted once the cache holds statement_cache statements, and psycopg keeps
+    # as many prepared on the server
+    def cached_statement(self, conn: psycopg.Connection, fields, record_cnt, ins_sql, con_sql):
+        if conn is not self.statements_conn:
+            self.statements.clear()
+            self.statements_conn = conn
+            conn.prepared_max = self.statement_cache
+
+        resolution = "update" if "DO UPDATE" in con_sql else "nothing" if con_sql else ""
+        key = (ins_sql.split()[2], 0 if self.statement_mode == "unnest" else record_cnt, resolution)
+        statement = self.statements.get(key)
+        if statement is not None:
+            self.statements.move_to_end(key)
+            self.statement_hits += 1
+            return statement
+
+        self.statement_misses += 1
+        statement = self.statements[key] = self.build_statement(fields, record_cnt, ins_sql, con_sql)
+        if len(self.statements) > self.statement_cache:
+            self.statements.popitem(last=False)
+            self.statement_evictions += 1
+        return statement
+
+
+
+    def send_copy(self, conn: psycopg.Connection, data, record_cnt, copy_sql):
+        start = time.perf_counter()
+        sent = time.time()
+        fields = int(len(data) / record_cnt)
+        table = copy_sql.split()[1]
+        if self.join_group(conn, table, copy_sql, (fields, data), record_cnt):
+            self.count_sent(table, record_cnt, copy_sql, data, "")
         with conn.cursor() as cur:
-            cur.execute(f"{ins_sql} VALUES {values} {con_sql};", tuple(data))
+            with cur.copy(copy_sql) as copy:
+                for i in range(0, len(data), fields):
+                    copy.write_row(data[i:i + fields])
+        if self.capture:
+            self.capture_sent(sent, copy_sql, (fields, data))
+
+        if self.controllers:
+            self.adapt(table, time.perf_counter() - start, record_cnt)
+
+        if self.metrics.enabled:
+            self.metrics.observe("statement_seconds", time.perf_counter() - start, table=table)
+        if not self.group:
+            self.count_sent(table, record_cnt, copy_sql, data, "")
 
 
 
     def flush_address(self, conn: psycopg.Connection, data, record_cnt, sql):
         # print(f"id: {self.id} and counter: {self.counter} FLUSH_ADDRESS called")
-        if (random.randint(1, 100) <= self.update_freq):
+        if (self.random.randint(1, 100) <= self.update_freqs["address"]):
             resolve_it = """
             ON CONFLICT (acct_num) DO UPDATE SET
                 street = excluded.street,
@@ -153,7 +1532,7 @@ class Transactionwin:
 
     def flush_city_loc(self, conn: psycopg.Connection, data, record_cnt, sql):
         # print(f"id: {self.id} and counter: {self.counter} FLUSH_CITY_LOC called")
-        if (random.randint(1, 100) <= self.update_freq):
+        if (self.random.randint(1, 100) <= self.update_freqs["city_loc"]):
             resolve_it = """
             ON CONFLICT (zip) DO UPDATE SET
                 city = excluded.city,
@@ -169,7 +1548,7 @@ class Transactionwin:
 
     def flush_customer(self, conn: psycopg.Connection, data, record_cnt, sql):
         # print(f"id: {self.id} and counter: {self.counter} FLUSH_CUSTOMER called")
-        if (random.randint(1, 100) <= self.update_freq):
+        if (self.random.randint(1, 100) <= self.update_freqs["customer"]):
             resolve_it = """
             ON CONFLICT (ssn) DO UPDATE SET
                 cc_num = excluded.cc_num,
@@ -190,7 +1569,7 @@ class Transactionwin:
 
     def flush_merchant(self, conn: psycopg.Connection, data, record_cnt, sql):
         # print(f"id: {self.id} and counter: {self.counter} FLUSH_MERCHANT called")
-        if (random.randint(1, 100) <= self.update_freq):
+        if (self.random.randint(1, 100) <= self.update_freqs["merchant"]):
             resolve_it = """
             ON CONFLICT (id) DO UPDATE SET
                 merchant = excluded.merchant,
@@ -204,186 +1583,565 @@ class Transactionwin:
 
 
 
+    # the transaction table is append only, so there's no conflict to resolve
+    # and the rows can be bulk loaded with COPY instead of a multi-row insert
+    def flush_transaction(self, conn: psycopg.Connection, data, record_cnt, sql):
+        # print(f"id: {self.id} and counter: {self.counter} FLUSH_TRANSACTION called")
+        if self.load_mode == "copy":
+            copy_sql = """
+            COPY transaction (
+                cc_num, trans_num, trans_date, trans_time, unix_time, category, merch_id, amt, is_fraud
+            ) FROM STDIN
+            """
+            if self.key_mode == "client":
+                copy_sql = copy_sql.replace("cc_num,", "id, cc_num,", 1)
+            self.copy(conn, data, record_cnt, copy_sql)
+        else:
+            self.execute(conn, data, record_cnt, sql, "")
+
+        if self.key_mode == "client":
+            ranges = len({id.int >> 124 for id in data[::len(data) // record_cnt]})
+            self.range_batches += 1
+            self.range_count += ranges
+            if self.metrics.enabled:
+                self.metrics.count("range_batches_total", table="transaction")
+                self.metrics.count("ranges_total", ranges, table="transaction")
+
+
+
+    # every thread generates the same seeded customers, so with partitioned keys the account,
+    # card and ssn of a thread's customers are moved into a range of the thread's own. a card
+    # number shorter than the thread's share of the cards is kept, only the longest ones wrap
+    def partition(self, record):
+        record = list(record)
+        record[Field.ssn.value] = f"{self.id}-{record[Field.ssn.value]}"
+        cc_span = CC_NUM_MAX // self.total_thread_count
+        record[Field.cc_num.value] = (self.id % self.total_thread_count * cc_span
+            + int(record[Field.cc_num.value]) % cc_span)
+        record[Field.acct_num.value] = self.id * ACCT_NUM_SPAN + int(record[Field.acct_num.value])
+        return record
+
+
+
+    # zips and merchants are shared by all the threads, so each one is only upserted by
+    # the thread a stable hash of the key picks, whichever process the threads run in
+    def owns(self, key):
+        owned = self.owners.get(key)
+        if owned is None:
+            owned = self.owners[key] = (
+                zlib.crc32(str(key).encode()) % self.total_thread_count == self.id % self.total_thread_count)
+        return owned
+
+
+
+    # with a rate the transaction batches are sent on an open loop schedule that carries over from
+    # one window to the next. a batch is due once the rows before it have had their share of the rate,
+    # and its latency is measured from when it was due rather than when it was sent, so a slow
+    # statement also counts against the batches that were queued behind it
+    def flush_scheduled(self, conn: psycopg.Connection, data, record_cnt, sql):
+        if self.rate <= 0:
+            self.flush(conn, self.flush_transaction, data, record_cnt, sql)
+            return
+
+        if self.schedule_start is None:
+            self.schedule_start = time.perf_counter()
+        due = self.schedule_start + self.scheduled_rows * self.total_thread_count / self.rate
+        self.scheduled_rows += record_cnt
+        start = time.perf_counter()
+        if due > start:
+            time.sleep(due - start)
+            start = time.perf_counter()
+
+        self.flush(conn, self.flush_transaction, data, record_cnt, sql)
+        # in pipeline mode the batch is only queued, so it's measured once the pipeline is synced
+        queued = self.pending.get("transaction")
+        if queued is not None and queued[1] is data:
+            self.scheduled_batch = (due, start, record_cnt)
+        else:
+            self.scheduled_sent_batch(due, start, record_cnt)
+
+
+
+    def scheduled_sent_batch(self, due, start, record_cnt):
+        end = time.perf_counter()
+        self.scheduled_sent += record_cnt
+        self.scheduled_latency.record(end - due)
+        self.service_latency.record(end - start)
+        if self.metrics.enabled:
+            self.metrics.observe("scheduled_seconds", end - due, table="transaction")
+
+
+
+    def report_schedule(self):
+        if self.scheduled_latency.total == 0:
+            return
+        elapsed = time.perf_counter() - self.schedule_start
+        print(f"id: {self.id} and counter: {self.counter} rate target:"
+            f" {self.rate / self.total_thread_count:,.0f} rows/s achieved: {self.scheduled_sent / elapsed:,.0f} rows/s"
+            f" {self.scheduled_latency.total} batches")
+        print(f"id: {self.id} and counter: {self.counter} latency from schedule {self.scheduled_latency.report()}")
+        print(f"id: {self.id} and counter: {self.counter} latency from send {self.service_latency.report()}")
+
+
+
+    # a random version 4 uuid whose leading hex digit, the range of the pre-split
+    # transaction table it goes to, is one of the ranges the thread writes to
+    def transaction_id(self):
+        leading = self.owned_ranges[self.random.randrange(len(self.owned_ranges))]
+        return uuid.UUID(int=(leading << 124) | self.random.getrandbits(124), version=4)
+
+
+
+    # in pipeline mode a batch is queued until another batch for the same table
+    # comes along, then the queued batches for all the tables are sent together
+    def flush(self, conn: psycopg.Connection, flush_table, data, record_cnt, sql):
+        if self.flush_mode != "pipeline" or (
+                self.load_mode == "copy" and flush_table == self.flush_transaction):
+            # COPY can't be used in pipeline mode
+            try:
+                flush_table(conn, data, record_cnt, sql)
+            except psycopg.Error:
+                self.abort_group(conn)
+                self.clear_caches()
+                self.adapt(flush_table.__name__.removeprefix("flush_"))
+                raise
+            return
+
+        table = flush_table.__name__.removeprefix("flush_")
+        if table in self.pending:
+            self.send_pipeline(conn)
+        self.pending[table] = (flush_table, data, record_cnt, sql)
+
+
+
+    # feeds the latency of a statement, or a failure without one, to the batch controller for the table
+    def adapt(self, table, seconds=None, rows=0):
+        controller = self.controllers.get(table)
+        if controller is None:
+            return
+        if seconds is None:
+            controller.backoff()
+        else:
+            # a batch of the rounded down size is a full batch for the controller too,
+            # otherwise it would never see one and stop growing
+            if rows >= self.batch_sizes[table]:
+                rows = max(rows, controller.size)
+            controller.observe(seconds, rows)
+        self.batch_sizes[table] = controller.size
+        # full batches of the prepared multi-row inserts are rounded down to a power of two,
+        # so the adaptive sizes only add a shape when the size doubles or halves
+        if self.statement_cache > 0 and self.statement_mode != "unnest":
+            self.batch_sizes[table] = 1 << (controller.size.bit_length() - 1)
+        if self.metrics.enabled:
+            self.metrics.gauge("batch_size", controller.size, table=table)
+
+
+
+    # a row is only sent if the cache is disabled or it changed since it was last sent
+    def changed(self, table, key, row):
+        return self.cache_size <= 0 or self.caches[table].changed(key, row)
+
+
+
+    # after a failed write we can't tell which cached rows made it to the database
+    def clear_caches(self):
+        for cache in self.caches.values():
+            cache.clear()
+
+
+
+    # flattens the rows coalesced on their conflict key into the parameters for one batch
+    def flush_rows(self, conn: psycopg.Connection, flush_table, rows, sql):
+        data = [value for row in rows.values() for value in row]
+        self.flush(conn, flush_table, data, len(rows), sql)
+
+
+
+    def send_pipeline(self, conn: psycopg.Connection):
+        # print(f"id: {self.id} and counter: {self.counter} SEND_PIPELINE called")
+        pending = self.pending
+        self.pending = {}
+        # the scheduled transaction batch queued in this pipeline, if there is one
+        scheduled = self.scheduled_batch if "transaction" in pending else None
+        self.scheduled_batch = None
+        try:
+            start = time.perf_counter()
+            self.pipelining = True
+            with self.metrics.timer("phase_seconds", phase="pipeline"), conn.pipeline():
+                for flush_table, data, record_cnt, sql in pending.values():
+                    flush_table(conn, data, record_cnt, sql)
+            self.pipelining = False
+            if self.pipeline_error:
+                raise self.pipeline_error
+            if not self.group:
+                self.flush_captured()
+            # the batches in a pipeline complete together, so they share its latency
+            if self.controllers:
+                elapsed = time.perf_counter() - start
+                for table, (flush_table, data, record_cnt, sql) in pending.items():
+                    self.adapt(table, elapsed, record_cnt)
+            if scheduled:
+                self.scheduled_sent_batch(*scheduled)
+        except psycopg.Error as e:
+            self.pipelining = False
+            self.pipeline_error = None
+            self.captured = []
+            # in an explicit transaction the group is retried or rolled back as a whole
+            if self.group:
+                if isinstance(e, psycopg.errors.SerializationFailure):
+                    self.retry_group(conn)
+                    if scheduled:
+                        self.scheduled_sent_batch(*scheduled)
+                    return
+                self.abort_group(conn)
+                self.clear_caches()
+                raise
+            # statements in a pipeline share an implicit transaction until the sync,
+            # so nothing was written and each batch can be sent on its own to report the failed tables
+            failed = None
+            for table, (flush_table, data, record_cnt, sql) in pending.items():
+                try:
+                    flush_table(conn, data, record_cnt, sql)
+                except psycopg.Error as e:
+                    print(f"id: {self.id} and counter: {self.counter} failed to flush {table}: {e}")
+                    self.adapt(table)
+                    failed = failed or e
+            if failed:
+                self.clear_caches()
+                raise failed
+            if scheduled:
+                self.scheduled_sent_batch(*scheduled)
+
+
+
+    # commits the explicit transaction of the batches flushed since the last commit,
+    # after sending the batches still queued for a pipeline
+    def commit(self, conn: psycopg.Connection):
+        if self.pending:
+            self.send_pipeline(conn)
+        if not self.group:
+            return
+
+        start = time.perf_counter()
+        try:
+            conn.commit()
+        except psycopg.errors.SerializationFailure:
+            self.retry_group(conn, commit=True)
+        except psycopg.Error:
+            self.abort_group(conn)
+            self.clear_caches()
+            raise
+        elapsed = time.perf_counter() - start
+
+        rows = sum(record_cnt for table, statement, params, record_cnt in self.group
+            if table == "transaction")
+        self.commits += 1
+        self.commit_rows += rows
+        self.commit_seconds += elapsed
+        if self.metrics.enabled:
+            self.metrics.observe("commit_seconds", elapsed)
+            self.metrics.count("commits_total")
+            self.metrics.count("commit_rows_total", rows)
+        self.flush_captured()
+        self.group = []
+
+
+
+    # the statements of an explicit transaction or a pipeline are only written to the capture log
+    # once they are committed or synced, so the ones rolled back and sent again aren't replayed twice
+    def capture_sent(self, sent, statement, params):
+        if self.group or self.pipelining:
+            self.captured.append((sent, statement, params))
+        else:
+            self.capture.record(sent, statement, params)
+
+
+
+    def flush_captured(self):
+        for sent, statement, params in self.captured:
+            self.capture.record(sent, statement, params)
+        self.captured = []
+
+
+
+    # in an explicit transaction the statements are kept as they were sent, so a retry of the
+    # group sends the same statements again rather than building and counting them a second time
+    def join_group(self, conn: psycopg.Connection, table, statement, params, record_cnt):
+        if self.commit_batches <= 0:
+            return False
+        if not self.group:
+            conn.execute("BEGIN")
+        self.group.append((table, statement, params, record_cnt))
+        return True
+
+
+
+    # a serialization failure aborts the explicit transaction, so after a jittered backoff
+    # every statement of the group is sent again in a new one, up to retry_max times.
+    # the batches still queued for a pipeline haven't been sent, so they stay queued
+    def retry_group(self, conn: psycopg.Connection, commit=False):
+        attempt = 0
+        while True:
+            conn.rollback()
+            self.captured = []
+            attempt += 1
+            if attempt > self.retry_max:
+                self.count_retry("commit", "give_up")
+                self.group = []
+                self.pending = {}
+                self.clear_caches()
+                raise psycopg.errors.SerializationFailure(
+                    f"gave up on an explicit transaction after {self.retry_max} retries")
+
+            self.count_retry("commit", "retry")
+            backoff = min(self.retry_cap, self.retry_base * 2 ** (attempt - 1))
+            time.sleep(self.random.uniform(0, backoff) / 1000)
+            try:
+                conn.execute("BEGIN")
+                with conn.cursor() as cur:
+                    for table, statement, params, record_cnt in self.group:
+                        sent = time.time()
+                        if statement.lstrip().startswith("COPY"):
+                            fields, data = params
+                            with cur.copy(statement) as copy:
+                                for i in range(0, len(data), fields):
+                                    copy.write_row(data[i:i + fields])
+                        else:
+                            cur.execute(statement, params, prepare=self.statement_cache > 0 or None)
+                        if self.capture:
+                            self.captured.append((sent, statement, params))
+                if commit:
+                    conn.commit()
+                return
+            except psycopg.errors.SerializationFailure:
+                continue
+            except psycopg.Error:
+                self.abort_group(conn)
+                self.clear_caches()
+                raise
+
+
+
+    def abort_group(self, conn: psycopg.Connection):
+        if self.group:
+            self.group = []
+            self.pending = {}
+            self.captured = []
+            conn.rollback()
+
+
+
     def transact(self, conn: psycopg.Connection):
+        with self.metrics.timer("phase_seconds", phase="transact"):
+            self.write_batches(conn)
+
+        if self.cache_size > 0:
+            print(f"id: {self.id} and counter: {self.counter} cache " + ", ".join(
+                f"{table} hits: {cache.hits} misses: {cache.misses} evictions: {cache.evictions}"
+                for table, cache in self.caches.items()))
+
+        if self.statement_cache > 0:
+            print(f"id: {self.id} and counter: {self.counter} statement cache hits: {self.statement_hits}"
+                f" misses: {self.statement_misses} evictions: {self.statement_evictions}")
+
+        if self.parse_pool is not None:
+            print(f"id: {self.id} and counter: {self.counter} parse pool processes: {self.parse_workers}")
+
+        if self.range_batches:
+            print(f"id: {self.id} and counter: {self.counter} transaction batches: {self.range_batches}"
+                f" ranges per batch: {self.range_count / self.range_batches:.2f}")
+
+        if self.rate > 0:
+            self.report_schedule()
+
+        if self.capture:
+            self.capture.flush()
+            print(f"id: {self.id} and counter: {self.counter} captured statements: {self.capture.count}"
+                f" log size: {self.capture.bytes:,} bytes")
+
+        if self.commits:
+            print(f"id: {self.id} and counter: {self.counter} commits: {self.commits}"
+                f" rows per commit: {self.commit_rows / self.commits:.1f}"
+                f" average commit latency: {self.commit_seconds / self.commits * 1000:.2f}ms")
+
+        if self.retries:
+            print(f"id: {self.id} and counter: {self.counter} serialization failures " + ", ".join(
+                f"{table} {outcome}: {count}" for (table, outcome), count in sorted(self.retries.items())))
+
+        if self.metrics.enabled:
+            for table, cache in self.caches.items():
+                self.metrics.set("cache_hits_total", cache.hits, table=table)
+                self.metrics.set("cache_misses_total", cache.misses, table=table)
+                self.metrics.set("cache_evictions_total", cache.evictions, table=table)
+            self.metrics.set("statement_cache_hits_total", self.statement_hits)
+            self.metrics.set("statement_cache_misses_total", self.statement_misses)
+            self.metrics.set("statement_cache_evictions_total", self.statement_evictions)
+            self.metrics.write()
+
+
+
+    def write_batches(self, conn: psycopg.Connection):
         # print(f"id: {self.id} and counter: {self.counter} TRANSACT called")
 
+        # the dimension rows are coalesced on their conflict key, the last row for a key wins,
+        # so every statement carries a full batch of distinct keys,
+        # and with a cache the rows that didn't change since they were last sent are skipped
         addr_sql = """
         INSERT INTO address (
             acct_num, street, zip, lat, lng
         )
         """
-        addr_cnt = 0
-        addr_data = []
-        unique_addr = []
+        addr_data = {}
+        addr_dups = 0
 
         city_sql = """
         INSERT INTO city_loc (
             zip, city, state, city_pop
         )
         """
-        city_cnt = 0
-        city_data = []
-        unique_city = []
+        city_data = {}
+        city_dups = 0
 
         cust_sql = """
         INSERT INTO customer (
             ssn, cc_num, first, last, gender, job, dob, acct_num, profile
         )
         """
-        cust_cnt = 0
-        cust_data = []
-        unique_cust = []
+        cust_data = {}
+        cust_dups = 0
 
         merc_sql = """
         INSERT INTO merchant (
             id, merchant, merch_lat, merch_lng
         )
         """
-        merc_cnt = 0
-        merc_data = []
-        unique_merc = []
+        merc_data = {}
+        merc_dups = 0
 
         sql = """
         INSERT INTO transaction (
             cc_num, trans_num, trans_date, trans_time, unix_time, category, merch_id, amt, is_fraud
         )
         """
-        record_cnt = 0
-        data = []
+        # with client keys each range has its own batch, so a batch commits on a single range
+        if self.key_mode == "client":
+            sql = sql.replace("cc_num,", "id, cc_num,", 1)
+        trans_cnt = {}
+        trans_data = {}
+        sizes = self.batch_sizes
+        batches = 0
+
+        partitioned = self.key_space == "partitioned"
 
         for record in self.records:
+            if partitioned:
+                record = self.partition(record)
 
             # ADDRESS
-            acct_num = record[Field.acct_num.value]
-            if acct_num in unique_addr:
-                self.flush_address(conn, addr_data, addr_cnt, addr_sql)
-                addr_cnt = 0
-                addr_data = []
-                unique_addr = []
-                
-            unique_addr.append(acct_num)
-            addr_cnt += 1
-            addr_data += [
-                acct_num,
-                record[Field.street.value],
-                record[Field.zip.value],
-                record[Field.lat.value],
-                record[Field.lng.value]
-            ]
-
-            if addr_cnt >= self.batch_size:
-                self.flush_address(conn, addr_data, addr_cnt, addr_sql)
-                addr_cnt = 0
-                addr_data = []
-                unique_addr = []
+            row = ADDRESS_VALUES(record)
+            acct_num = row[0]
+            if self.changed("address", acct_num, row):
+                addr_dups += acct_num in addr_data
+                addr_data[acct_num] = row
+
+            if len(addr_data) >= sizes["address"]:
+                self.flush_rows(conn, self.flush_address, addr_data, addr_sql)
+                addr_data = {}
 
 
             # CITY LOCATION
-            zip = record[Field.zip.value]
-            if zip in unique_city:
-                self.flush_city_loc(conn, city_data, city_cnt, city_sql)
-                city_cnt = 0
-                city_data = []
-                unique_city = []
-
-            unique_city.append(zip)
-            city_cnt += 1
-            city_data += [
-                zip,
-                record[Field.city.value],
-                record[Field.state.value],
-                record[Field.city_pop.value]
-            ]
-
-            if city_cnt >= self.batch_size:
-                self.flush_city_loc(conn, city_data, city_cnt, city_sql)
-                city_cnt = 0
-                city_data = []
-                unique_city = []
+            row = CITY_LOC_VALUES(record)
+            zip = row[0]
+            if (not partitioned or self.owns(zip)) and self.changed("city_loc", zip, row):
+                city_dups += zip in city_data
+                city_data[zip] = row
+
+            if len(city_data) >= sizes["city_loc"]:
+                self.flush_rows(conn, self.flush_city_loc, city_data, city_sql)
+                city_data = {}
 
 
             # CUSTOMER
-            ssn = record[Field.ssn.value]
-            if ssn in unique_cust:
-                self.flush_customer(conn, cust_data, cust_cnt, cust_sql)
-                cust_cnt = 0
-                cust_data = []
-                unique_cust = []
-
-            unique_cust.append(ssn)
-            cust_cnt += 1
-            cust_data += [
-                ssn,
-                record[Field.cc_num.value],
-                record[Field.first.value],
-                record[Field.last.value],
-                record[Field.gender.value],
-                record[Field.job.value],
-                record[Field.dob.value],
-                record[Field.acct_num.value],
-                record[Field.profile.value]
-            ]
-
-            if cust_cnt >= self.batch_size:
-                self.flush_customer(conn, cust_data, cust_cnt, cust_sql)
-                cust_cnt = 0
-                cust_data = []
-                unique_cust = []
+            row = CUSTOMER_VALUES(record)
+            ssn = row[0]
+            if self.changed("customer", ssn, row):
+                cust_dups += ssn in cust_data
+                cust_data[ssn] = row
+
+            if len(cust_data) >= sizes["customer"]:
+                self.flush_rows(conn, self.flush_customer, cust_data, cust_sql)
+                cust_data = {}
 
             # MERCHANT
-            id = record[Field.merch_id.value]
-            if id in unique_merc:
-                self.flush_merchant(conn, merc_data, merc_cnt, merc_sql)
-                merc_cnt = 0
-                merc_data = []
-                unique_merc = []
-
-            unique_merc.append(id)
-            merc_cnt += 1
-            merc_data += [
-                id,
-                record[Field.merchant.value],
-                record[Field.merch_lat.value],
-                record[Field.merch_lng.value]
-            ]
-
-            if merc_cnt >= self.batch_size:
-                self.flush_merchant(conn, merc_data, merc_cnt, merc_sql)
-                merc_cnt = 0
-                merc_data = []
-                unique_merc = []
+            # the merchant coordinates are drawn again for every transaction, so only
+            # the name tells the cache whether the merchant changed
+            row = MERCHANT_VALUES(record)
+            id = row[0]
+            if (not partitioned or self.owns(id)) and self.changed("merchant", id, row[:2]):
+                merc_dups += id in merc_data
+                merc_data[id] = row
+
+            if len(merc_data) >= sizes["merchant"]:
+                self.flush_rows(conn, self.flush_merchant, merc_data, merc_sql)
+                merc_data = {}
 
             # TRANSACTION
-            record_cnt += 1
-            data += [
-                record[Field.cc_num.value],
-                record[Field.trans_num.value],
-                record[Field.trans_date.value],
-                record[Field.trans_time.value],
-                record[Field.unix_time.value],
-                record[Field.category.value],
-                record[Field.merch_id.value],
-                record[Field.amt.value],
-                record[Field.is_fraud.value]
-            ]
-
-            if record_cnt >= self.batch_size:
-                self.execute(conn, data, record_cnt, sql, "")
-                record_cnt = 0
-                data = []
-
-
-        if addr_cnt > 0:
-            self.flush_address(conn, addr_data, addr_cnt, addr_sql)
-
-        if city_cnt > 0:
-            self.flush_city_loc(conn, city_data, city_cnt, city_sql)
-
-        if cust_cnt > 0:
-            self.flush_customer(conn, cust_data, cust_cnt, cust_sql)
-
-        if merc_cnt > 0:
-            self.flush_merchant(conn, merc_data, merc_cnt, merc_sql)
-
-        if record_cnt > 0:
-            self.execute(conn, data, record_cnt, sql, "")
+            if self.key_mode == "client":
+                id = self.transaction_id()
+                key = id.int >> 124
+                values = (id,) + TRANSACTION_VALUES(record)
+            else:
+                key = 0
+                values = TRANSACTION_VALUES(record)
+            data = trans_data.setdefault(key, [])
+            data += values
+            record_cnt = trans_cnt[key] = trans_cnt.get(key, 0) + 1
+
+            if record_cnt >= sizes["transaction"]:
+                self.flush_scheduled(conn, data, record_cnt, sql)
+                del trans_cnt[key]
+                del trans_data[key]
+                batches += 1
+
+                # the dimension rows the transaction batches need go into the same commit
+                if self.commit_batches > 0 and batches % self.commit_batches == 0:
+                    if addr_data:
+                        self.flush_rows(conn, self.flush_address, addr_data, addr_sql)
+                        addr_data = {}
+                    if city_data:
+                        self.flush_rows(conn, self.flush_city_loc, city_data, city_sql)
+                        city_data = {}
+                    if cust_data:
+                        self.flush_rows(conn, self.flush_customer, cust_data, cust_sql)
+                        cust_data = {}
+                    if merc_data:
+                        self.flush_rows(conn, self.flush_merchant, merc_data, merc_sql)
+                        merc_data = {}
+                    self.commit(conn)
+
+
+        if addr_data:
+            self.flush_rows(conn, self.flush_address, addr_data, addr_sql)
+
+        if city_data:
+            self.flush_rows(conn, self.flush_city_loc, city_data, city_sql)
+
+        if cust_data:
+            self.flush_rows(conn, self.flush_customer, cust_data, cust_sql)
+
+        if merc_data:
+            self.flush_rows(conn, self.flush_merchant, merc_data, merc_sql)
+
+        for key, data in trans_data.items():
+            self.flush_scheduled(conn, data, trans_cnt[key], sql)
+
+        if self.commit_batches > 0:
+            self.commit(conn)
+        elif self.pending:
+            self.send_pipeline(conn)
+
+        if self.metrics.enabled:
+            self.metrics.count("duplicates_total", addr_dups, table="address")
+            self.metrics.count("duplicates_total", city_dups, table="city_loc")
+            self.metrics.count("duplicates_total", cust_dups, table="customer")
+            self.metrics.count("duplicates_total", merc_dups, table="merchant")